@@ -1,66 +1,38 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-import struct
+from tkinter import filedialog, messagebox, simpledialog
+from PIL import ImageTk
 import os
-import csv
-import copy
-
-PALETTE_PATH = 'color.pal'
-RECOLOUR_CSV_PATH = 'recolour.txt'
-SCALE_FACTOR = 4  # will be adjusted dynamically per frame
-
-def load_palette(pal_path):
-    with open(pal_path, 'rb') as f:
-        data = f.read(768)
-    return [(r * 4, g * 4, b * 4) for r, g, b in struct.iter_unpack('BBB', data)]
-
-def load_recolour_map(csv_path):
-    recolour_map = {}
-    with open(csv_path, newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row and len(row) == 2:
-                recolour_map[int(row[0])] = int(row[1])
-    return recolour_map
-
-def frm_is_single_direction(frm_type):
-    return frm_type.upper() in {"FR0", "FR1", "FR2", "FR3", "FR4", "FR5"}
-
-def get_total_frames(frm_bytes, frm_type):
-    frame_count = struct.unpack(">H", frm_bytes[8:10])[0]
-    return frame_count if frm_is_single_direction(frm_type) else frame_count * 6
-
-def parse_frames(frm_bytes, frm_type):
-    header = frm_bytes[:62]
-    offset = 62
-    frames = []
-    total = get_total_frames(frm_bytes, frm_type)
-    for _ in range(total):
-        width, height = struct.unpack(">HH", frm_bytes[offset:offset + 4])
-        size = width * height
-        pixel_data = list(frm_bytes[offset + 12: offset + 12 + size])
-        frames.append({
-            'offset': offset,
-            'header': frm_bytes[offset:offset + 12],
-            'width': width,
-            'height': height,
-            'pixels': pixel_data
-        })
-        offset += 12 + size
-    return header, frames
-
-def rebuild_frm(header, frames):
-    body = b''.join(f['header'] + bytes(f['pixels']) for f in frames)
-    return header + body
-
-def scale_image(pixels, width, height, palette, max_size=(300, 300)):
-    img = Image.new("RGB", (width, height))
-    img.putdata([palette[i] for i in pixels])
-    scale_w = max_size[0] // width
-    scale_h = max_size[1] // height
-    scale = min(scale_w, scale_h, SCALE_FACTOR)
-    return img.resize((width * scale, height * scale), Image.NEAREST), scale
+import threading
+import numpy as np
+from collections import OrderedDict
+from queue import Empty, Queue
+from frm import FRM_TYPES, copy_frames, parse_frames, patch_file, rebuild_frm
+from palette import PALETTE_PATH, load_palette, scale_image
+from recolour import RECOLOUR_CSV_PATH, load_recolour_table
+from regions import frame_directions, load_masks, load_region_rules, masks_path_for, save_masks
+
+RENDER_CACHE_SIZE = 64  # rendered frames kept for instant redisplay
+PREFETCH_FRAMES = 3  # frames rendered ahead on each side while the app is idle
+UNDO_LIMIT = 500  # edits kept for undo/redo
+SAVE_POLL_MS = 100  # how often finished background saves are checked for
+
+class OpenFile:
+    # One loaded file with its edits: the frames as read and as edited, the
+    # undo history, painted masks and what still needs saving
+    def __init__(self, path, frm_type, mtime_ns, data):
+        self.path = path
+        self.frm_type = frm_type
+        self.mtime_ns = mtime_ns
+        self.frm_header, self.input_frames = parse_frames(data, frm_type)
+        self.output_frames = copy_frames(self.input_frames)
+        self.frame_index = 0
+        self.frame_versions = [0] * len(self.output_frames)
+        self.directions = frame_directions(self.frm_header, frm_type)
+        self.undo_stack = []
+        self.redo_stack = []
+        self.mask_rects = {}
+        self.dirty = set()  # frames edited since the last save
+        self.saved_path = None  # file holding the frames as they were at the last save
 
 class RecolourApp:
     def __init__(self, root):
@@ -68,7 +40,12 @@ class RecolourApp:
         self.root.title("FRM Recolour Tool")
 
         self.palette = load_palette(PALETTE_PATH)
-        self.recolour_map = load_recolour_map(RECOLOUR_CSV_PATH)
+        try:
+            self.recolour_table = load_recolour_table(RECOLOUR_CSV_PATH)
+        except ValueError as e:
+            # Masks for the rules may be what is about to be painted here
+            messagebox.showwarning("Masks", f"{e}. Those rules change nothing until the masks are saved.")
+            self.recolour_table = load_region_rules(RECOLOUR_CSV_PATH, require_masks=False)
         self.root.geometry("900x600")
 
         # GUI Variables
@@ -77,15 +54,21 @@ class RecolourApp:
         self.frm_prefix = tk.StringVar()
         self.out_prefix = tk.StringVar()
         self.anim_type = tk.StringVar()
+        self.paint_mask = tk.BooleanVar()
 
         # UI Layout
         self.build_controls()
         self.bind_keys()
-        self.frame_index = 0
-        self.input_frames = []
-        self.output_frames = []
-        self.frm_header = b''
+        self.session = {}  # input path -> OpenFile
+        self.file = None  # the OpenFile being shown
+        self.saved_by = {}  # output path -> OpenFile last saved to it
         self.scale = 1
+        self.render_cache = OrderedDict()
+        self.prefetch_job = None
+        self.save_queue = Queue()
+        self.saved_queue = Queue()
+        threading.Thread(target=self.save_worker, daemon=True).start()
+        self.root.after(SAVE_POLL_MS, self.check_saves)
 
     def build_controls(self):
         control_frame = tk.Frame(self.root)
@@ -106,9 +89,13 @@ class RecolourApp:
         tk.Label(control_frame, text="Output Prefix:").grid(row=1, column=2)
         tk.Entry(control_frame, textvariable=self.out_prefix, width=15).grid(row=1, column=3)
 
-        tk.Button(control_frame, text="Load FRM", command=self.load_frm).grid(row=0, column=6, rowspan=2, padx=5)
-        tk.Button(control_frame, text="Save FRM", command=self.save_frm).grid(row=0, column=7, rowspan=2, padx=5)
-        tk.Button(control_frame, text="Undo Frame", command=self.undo_frame).grid(row=0, column=8, rowspan=2, padx=5)
+        tk.Button(control_frame, text="Load FRM", command=lambda: self.load_file("FRM")).grid(row=0, column=6, rowspan=2, padx=5)
+        tk.Button(control_frame, text="Save FRM", command=lambda: self.save_file("FRM")).grid(row=0, column=7, rowspan=2, padx=5)
+        tk.Button(control_frame, text="Undo", command=self.undo).grid(row=0, column=8, padx=5)
+        tk.Button(control_frame, text="Redo", command=self.redo).grid(row=1, column=8, padx=5)
+        tk.Button(control_frame, text="Reset Frame", command=self.reset_frame).grid(row=0, column=9, rowspan=2, padx=5)
+        tk.Checkbutton(control_frame, text="Paint Mask", variable=self.paint_mask).grid(row=0, column=10, padx=5)
+        tk.Button(control_frame, text="Save Mask", command=self.save_mask).grid(row=1, column=10, padx=5)
 
         nav_frame = tk.Frame(self.root)
         nav_frame.pack()
@@ -130,18 +117,18 @@ class RecolourApp:
         self.next5_btn.grid(row=0, column=3, rowspan = 2, padx=15)
         #fr05_frame.grid(row=0, column=4, padx=15)
         
-        tk.Button(nav_frame, text="Load FR0", command=self.load_fr0).grid(row=0, column=4, padx=5)
-        tk.Button(nav_frame, text="Save FR0", command=self.save_fr0).grid(row=1, column=4, padx=5)
-        tk.Button(nav_frame, text="Load FR1", command=self.load_fr1).grid(row=0, column=5, padx=5)
-        tk.Button(nav_frame, text="Save FR1", command=self.save_fr1).grid(row=1, column=5, padx=5)
-        tk.Button(nav_frame, text="Load FR2", command=self.load_fr2).grid(row=0, column=6, padx=5)
-        tk.Button(nav_frame, text="Save FR2", command=self.save_fr2).grid(row=1, column=6, padx=5)
-        tk.Button(nav_frame, text="Load FR3", command=self.load_fr3).grid(row=0, column=7, padx=5)
-        tk.Button(nav_frame, text="Save FR3", command=self.save_fr3).grid(row=1, column=7, padx=5)
-        tk.Button(nav_frame, text="Load FR4", command=self.load_fr4).grid(row=0, column=8, padx=5)
-        tk.Button(nav_frame, text="Save FR4", command=self.save_fr4).grid(row=1, column=8, padx=5)
-        tk.Button(nav_frame, text="Load FR5", command=self.load_fr5).grid(row=0, column=9, padx=5)
-        tk.Button(nav_frame, text="Save FR5", command=self.save_fr5).grid(row=1, column=9, padx=5)
+        tk.Button(nav_frame, text="Load FR0", command=lambda: self.load_file("FR0")).grid(row=0, column=4, padx=5)
+        tk.Button(nav_frame, text="Save FR0", command=lambda: self.save_file("FR0")).grid(row=1, column=4, padx=5)
+        tk.Button(nav_frame, text="Load FR1", command=lambda: self.load_file("FR1")).grid(row=0, column=5, padx=5)
+        tk.Button(nav_frame, text="Save FR1", command=lambda: self.save_file("FR1")).grid(row=1, column=5, padx=5)
+        tk.Button(nav_frame, text="Load FR2", command=lambda: self.load_file("FR2")).grid(row=0, column=6, padx=5)
+        tk.Button(nav_frame, text="Save FR2", command=lambda: self.save_file("FR2")).grid(row=1, column=6, padx=5)
+        tk.Button(nav_frame, text="Load FR3", command=lambda: self.load_file("FR3")).grid(row=0, column=7, padx=5)
+        tk.Button(nav_frame, text="Save FR3", command=lambda: self.save_file("FR3")).grid(row=1, column=7, padx=5)
+        tk.Button(nav_frame, text="Load FR4", command=lambda: self.load_file("FR4")).grid(row=0, column=8, padx=5)
+        tk.Button(nav_frame, text="Save FR4", command=lambda: self.save_file("FR4")).grid(row=1, column=8, padx=5)
+        tk.Button(nav_frame, text="Load FR5", command=lambda: self.load_file("FR5")).grid(row=0, column=9, padx=5)
+        tk.Button(nav_frame, text="Save FR5", command=lambda: self.save_file("FR5")).grid(row=1, column=9, padx=5)
         
         
         self.canvas_orig = tk.Canvas(self.root)
@@ -153,148 +140,113 @@ class RecolourApp:
         self.canvas_edit.bind("<Button-1>", self.start_select)
         self.canvas_edit.bind("<B1-Motion>", self.update_select)
         self.canvas_edit.bind("<ButtonRelease-1>", self.finish_select)
+        self.canvas_edit.bind("<Button-3>", lambda e: self.clear_mask())
         
     def bind_keys(self):
         self.root.bind("<Left>", lambda e: self.change_frame(-1))
         self.root.bind("<Right>", lambda e: self.change_frame(1))
+        self.root.bind("<Control-z>", lambda e: self.undo())
+        self.root.bind("<Control-y>", lambda e: self.redo())
         
-    def load_frm(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FRM")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FRM"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
-        
-    def load_fr0(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR0")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FR0"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
-        
-    def load_fr1(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR1")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FR1"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
-        
-    def load_fr2(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR2")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FR2"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
-        
-    def load_fr3(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR3")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FR3"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
-        
-    def load_fr4(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR4")
+    def file_name(self, in_or_out, frm_type):
+        if in_or_out == "in":
+            folder, prefix = self.input_dir.get(), self.frm_prefix.get()
+        else:
+            folder, prefix = self.output_dir.get(), self.out_prefix.get()
+        return os.path.join(folder, prefix.upper() + self.anim_type.get().upper() + "." + frm_type)
+
+    def load_file(self, frm_type):
+        # Files of the animation set are read the first time they are shown
+        # and kept, with their edits and undo history, until the input file
+        # changes on disk; switching back to one is instant
+        self.trim_session()
+        filename = self.file_name("in", frm_type)
         if not os.path.exists(filename):
             messagebox.showerror("Error", f"File not found: {filename}")
             return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
-
-        self.frm_type = "FR4"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
+        mtime_ns = os.stat(filename).st_mtime_ns
+        open_file = self.session.get(filename)
+        if open_file is not None and open_file.mtime_ns != mtime_ns:
+            if not open_file.dirty or messagebox.askyesno(
+                    "Changed", f"{filename} has changed on disk. Load it again and lose the unsaved edits?"):
+                open_file = None
+        if open_file is None:
+            with open(filename, "rb") as f:
+                open_file = OpenFile(filename, frm_type, mtime_ns, f.read())
+            self.session[filename] = open_file
+        self.file = open_file
+        self.root.title("FRM Recolour Tool - " + os.path.basename(filename))
         self.display_frame()
-        
-    def load_fr5(self):
-        prefix = self.frm_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        in_dir = self.input_dir.get()
-        filename = os.path.join(in_dir, prefix + suffix + ".FR5")
-        if not os.path.exists(filename):
-            messagebox.showerror("Error", f"File not found: {filename}")
-            return
-        with open(filename, "rb") as f:
-            self.frm_data = f.read()
 
-        self.frm_type = "FR5"
-        self.frm_header, self.input_frames = parse_frames(self.frm_data,self.frm_type)
-        self.output_frames = copy.deepcopy(self.input_frames)
-        self.frame_index = 0
-        self.display_frame()
+    def trim_session(self):
+        # Forget files of other animation sets once they have nothing unsaved,
+        # so moving through many sets doesn't keep every one in memory
+        current = {self.file_name("in", frm_type) for frm_type in FRM_TYPES}
+        for path, open_file in list(self.session.items()):
+            if path not in current and not open_file.dirty and open_file is not self.file:
+                del self.session[path]
+        self.saved_by = {out_name: f for out_name, f in self.saved_by.items() if f in self.session.values()}
+
+    def render_key(self, side, index):
+        # Output frames are cached per edit version, so an edit never shows a
+        # stale render, and every frame by the file's mtime, so neither does
+        # a file loaded again after it changed on disk
+        version = self.file.frame_versions[index] if side == "out" else 0
+        return (self.file.path, self.file.mtime_ns, side, index, version)
+
+    def render(self, side, index):
+        # PhotoImage of an input ("in") or output ("out") frame
+        key = self.render_key(side, index)
+        cached = self.render_cache.get(key)
+        if cached is not None:
+            self.render_cache.move_to_end(key)
+            return cached
+        f = (self.file.input_frames if side == "in" else self.file.output_frames)[index]
+        img, scale = scale_image(f.pixels, f.width, f.height, self.palette)
+        cached = (ImageTk.PhotoImage(img), img.width, img.height, scale)
+        self.render_cache[key] = cached
+        while len(self.render_cache) > RENDER_CACHE_SIZE:
+            self.render_cache.popitem(last=False)
+        return cached
 
     def display_frame(self):
-        f_in = self.input_frames[self.frame_index]
-        f_out = self.output_frames[self.frame_index]
-
-        img_in, self.scale = scale_image(f_in['pixels'], f_in['width'], f_in['height'], self.palette)
-        img_out, _ = scale_image(f_out['pixels'], f_out['width'], f_out['height'], self.palette)
-
-        self.tk_img_in = ImageTk.PhotoImage(img_in)
-        self.tk_img_out = ImageTk.PhotoImage(img_out)
+        self.tk_img_in, w_in, h_in, self.scale = self.render("in", self.file.frame_index)
+        self.tk_img_out, w_out, h_out, _ = self.render("out", self.file.frame_index)
 
-        self.canvas_orig.config(width=img_in.width, height=img_in.height)
-        self.canvas_edit.config(width=img_out.width, height=img_out.height)
+        self.canvas_orig.config(width=w_in, height=h_in)
+        self.canvas_edit.config(width=w_out, height=h_out)
 
         self.canvas_orig.create_image(0, 0, anchor="nw", image=self.tk_img_in)
         self.canvas_edit.create_image(0, 0, anchor="nw", image=self.tk_img_out)
+        for x0, y0, x1, y1 in self.file.mask_rects.get(self.file.frame_index, []):
+            self.canvas_edit.create_rectangle(x0 * self.scale, y0 * self.scale,
+                                              (x1 + 1) * self.scale, (y1 + 1) * self.scale, outline="blue")
 
         self.sel_start = None
         self.sel_rect = None
+        self.schedule_prefetch()
+
+    def schedule_prefetch(self):
+        # Render the neighbouring frames one at a time whenever Tk is idle, so
+        # stepping through the animation only ever shows cached images
+        if self.prefetch_job is not None:
+            self.root.after_cancel(self.prefetch_job)
+        pending = []
+        for step in range(1, PREFETCH_FRAMES + 1):
+            for index in (self.file.frame_index + step, self.file.frame_index - step):
+                index %= len(self.file.output_frames)
+                pending += [("out", index), ("in", index)]
+        self.prefetch_job = self.root.after_idle(self.prefetch, pending)
+
+    def prefetch(self, pending):
+        self.prefetch_job = None
+        while pending:
+            side, index = pending.pop(0)
+            if self.render_key(side, index) not in self.render_cache:
+                self.render(side, index)
+                break
+        if pending:
+            self.prefetch_job = self.root.after_idle(self.prefetch, pending)
 
     def start_select(self, event):
         self.sel_start = (event.x // self.scale, event.y // self.scale)
@@ -312,100 +264,116 @@ class RecolourApp:
                                                           outline="red")
 
     def finish_select(self, event):
-        if not self.sel_start:
+        if self.file is None or not self.sel_start:
             return
         x0, y0 = self.sel_start
         x1, y1 = event.x // self.scale, event.y // self.scale
         x0, x1 = sorted((x0, x1))
         y0, y1 = sorted((y0, y1))
 
-        frame = self.output_frames[self.frame_index]
-        w, h = frame['width'], frame['height']
-        pixels = frame['pixels']
-
-        for y in range(y0, min(y1+1, h)):
-            for x in range(x0, min(x1+1, w)):
-                idx = y * w + x
-                val = pixels[idx]
-                if val in self.recolour_map:
-                    pixels[idx] = self.recolour_map[val]
-
+        if self.paint_mask.get():
+            # Mark the area for rules limited to a mask, instead of recolouring it
+            self.file.mask_rects.setdefault(self.file.frame_index, []).append((max(x0, 0), max(y0, 0), x1, y1))
+            self.display_frame()
+            return
+        frame = self.file.output_frames[self.file.frame_index]
+        region = (slice(max(y0, 0), y1 + 1), slice(max(x0, 0), x1 + 1))
+        pixels = frame.pixels
+        if isinstance(self.recolour_table, np.ndarray):
+            new = self.recolour_table[pixels[region]]
+        else:
+            # Rules limited to part of the frame (see regions.py) still only
+            # change what falls inside the selection
+            new = self.recolour_table.recolour_image(pixels, self.file.frame_index, self.file.directions[self.file.frame_index])[region]
+        self.apply_edit(self.file.frame_index, region, new)
+
+    def clear_mask(self):
+        if self.file is None:
+            return
+        self.file.mask_rects.pop(self.file.frame_index, None)
         self.display_frame()
 
+    def save_mask(self):
+        # Add the painted areas to a masks file as "name/frame" entries,
+        # keeping any other masks already in it
+        if self.file is None or not self.file.mask_rects:
+            messagebox.showerror("Error", "Nothing painted: tick Paint Mask and select areas first")
+            return
+        name = simpledialog.askstring("Save Mask", "Mask name (used as mask=name in the recolour file):")
+        if not name:
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".npz", filetypes=[("Masks", "*.npz")],
+                                            initialfile=os.path.basename(masks_path_for(RECOLOUR_CSV_PATH)))
+        if not path:
+            return
+        masks = load_masks(path)
+        for index, rects in self.file.mask_rects.items():
+            f = self.file.output_frames[index]
+            mask = np.zeros((f.height, f.width), bool)
+            for x0, y0, x1, y1 in rects:
+                mask[y0:y1 + 1, x0:x1 + 1] = True
+            masks[name + "/" + str(index)] = mask
+        save_masks(masks, path)
+        messagebox.showinfo("Saved", f"Saved mask {name} for {len(self.file.mask_rects)} frames to {path}")
+
     def clear_selection(self):
         if self.sel_rect:
             self.canvas_orig.delete(self.sel_rect)
             self.sel_rect = None
 
-    def save_frm(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FRM")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr0(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR0")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr1(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR1")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr2(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR2")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr3(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR3")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr4(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR4")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
-        
-    def save_fr5(self):
-        out_prefix = self.out_prefix.get().upper()
-        suffix = self.anim_type.get().upper()
-        out_dir = self.output_dir.get()
-        out_name = os.path.join(out_dir, out_prefix + suffix + ".FR5")
-        new_data = rebuild_frm(self.frm_header, self.output_frames)
-        with open(out_name, "wb") as f:
-            f.write(new_data)
-        messagebox.showinfo("Saved", f"Saved to {out_name}")
+    def save_file(self, frm_type):
+        # Each Save button saves the loaded file of its own type, whichever
+        # file is on screen
+        in_name = self.file_name("in", frm_type)
+        open_file = self.session.get(in_name)
+        if open_file is None:
+            messagebox.showerror("Error", f"{os.path.basename(in_name)} is not loaded, load it first.")
+            return
+        self.save_output(open_file, self.file_name("out", frm_type))
+
+    def save_output(self, open_file, out_name):
+        # Saving again to the file saved last only rewrites the frames edited
+        # since, in place; anything else writes the whole file. The writing
+        # itself happens on the save thread, so Tk never waits for the disk.
+        same_file = (out_name == open_file.saved_path and self.saved_by.get(out_name) is open_file
+                     and os.path.exists(out_name) and os.path.getsize(out_name) == open_file.output_frames.end)
+        if same_file:
+            job = (open_file, out_name, None, open_file.output_frames.patches(open_file.dirty))
+        else:
+            job = (open_file, out_name, rebuild_frm(open_file.frm_header, open_file.output_frames), None)
+        open_file.saved_path = out_name
+        self.saved_by[out_name] = open_file
+        open_file.dirty.clear()
+        self.save_queue.put(job)
+
+    def save_worker(self):
+        # Saves are written one at a time, in the order they were made
+        while True:
+            open_file, out_name, data, patches = self.save_queue.get()
+            try:
+                if data is not None:
+                    with open(out_name, "wb") as f:
+                        f.write(data)
+                else:
+                    patch_file(out_name, patches)
+                self.saved_queue.put((open_file, out_name, None))
+            except OSError as e:
+                self.saved_queue.put((open_file, out_name, e))
+
+    def check_saves(self):
+        while True:
+            try:
+                open_file, out_name, error = self.saved_queue.get_nowait()
+            except Empty:
+                break
+            if error is None:
+                messagebox.showinfo("Saved", f"Saved to {out_name}")
+            else:
+                open_file.saved_path = None  # the next save writes the whole file again
+                if self.saved_by.get(out_name) is open_file:
+                    del self.saved_by[out_name]
+                messagebox.showerror("Error", f"Could not save {out_name}: {error}")
+        self.root.after(SAVE_POLL_MS, self.check_saves)
 
     #def undo_frame(self):
     #    self.output_frames[self.frame_index] = dict(self.input_frames[self.frame_index])
@@ -421,14 +389,60 @@ class RecolourApp:
     #        self.frame_index -= 1
     #        self.display_frame()
 
-    def undo_frame(self):
-        i = self.frame_index
-        self.output_frames[i] = copy.deepcopy(self.input_frames[i])#[:]
+    def apply_edit(self, index, region, new):
+        # Write new pixels into a region of an output frame, remembering only
+        # the smallest rectangle that actually changed and its old contents
+        pixels = self.file.output_frames[index].pixels
+        old = pixels[region]
+        rows, cols = np.nonzero(old != new)
+        if len(rows):
+            top, bottom = int(rows.min()), int(rows.max()) + 1
+            left, right = int(cols.min()), int(cols.max()) + 1
+            y0, x0 = region[0].start, region[1].start
+            changed = (slice(y0 + top, y0 + bottom), slice(x0 + left, x0 + right))
+            inner = (slice(top, bottom), slice(left, right))
+            self.file.undo_stack.append((index, changed, pixels[changed].copy(), new[inner].copy()))
+            del self.file.undo_stack[:-UNDO_LIMIT]
+            self.file.redo_stack.clear()
+            pixels[changed] = new[inner]
+            self.file.frame_versions[index] += 1
+            self.file.dirty.add(index)
+        self.display_frame()
+
+    def undo(self):
+        if self.file is None or not self.file.undo_stack:
+            return
+        index, region, old, new = self.file.undo_stack.pop()
+        self.file.redo_stack.append((index, region, old, new))
+        self.file.output_frames[index].pixels[region] = old
+        self.show_edit(index)
+
+    def redo(self):
+        if self.file is None or not self.file.redo_stack:
+            return
+        index, region, old, new = self.file.redo_stack.pop()
+        self.file.undo_stack.append((index, region, old, new))
+        self.file.output_frames[index].pixels[region] = new
+        self.show_edit(index)
+
+    def show_edit(self, index):
+        self.file.frame_versions[index] += 1
+        self.file.dirty.add(index)
+        self.file.frame_index = index
         self.display_frame()
 
+    def reset_frame(self):
+        # Back to the frame as loaded, as a single step that can be undone
+        if self.file is None or not self.file.output_frames:
+            return
+        i = self.file.frame_index
+        everything = (slice(0, None), slice(0, None))
+        self.apply_edit(i, everything, self.file.input_frames[i].pixels)
 
     def change_frame(self, delta):
-        self.frame_index = (self.frame_index + delta) % len(self.output_frames)
+        if self.file is None:
+            return
+        self.file.frame_index = (self.file.frame_index + delta) % len(self.file.output_frames)
         self.display_frame()
     
 
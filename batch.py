@@ -0,0 +1,253 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+from colour_index import frame_histograms, frames_to_recolour
+from contextlib import nullcontext
+from dat import DatArchive, DatWriter
+from dedup import FrameMemo
+from frm import FrmFile, frm_is_single_direction, frm_type_of, is_frm_file, map_file
+from instrument import StageTimer
+from recolour import recolour_frm
+
+# Folder-wide recolouring spread over a pool of worker processes. Each file is
+# one job; a job never raises, it reports what happened in its result record
+# so one bad file cannot abort the whole run.
+
+def find_frm_files(indir, recursive=True):
+    # Paths of every FRM/FR0-FR5 file under indir, relative to indir
+    found = []
+    if recursive:
+        for root, dirs, files in os.walk(indir):
+            dirs.sort()
+            for name in sorted(files):
+                if is_frm_file(name):
+                    found.append(os.path.relpath(os.path.join(root, name), indir))
+    else:
+        for name in sorted(os.listdir(indir)):
+            if is_frm_file(name) and os.path.isfile(os.path.join(indir, name)):
+                found.append(name)
+    return found
+
+def recolour_file(in_path, out_path, table, cache=None, colour_index=None):
+    return recolour_variants(in_path, [(out_path, table)], cache, colour_index)[0]
+
+def new_result(in_path, out_path):
+    return {'path': in_path, 'output': out_path, 'frames': 0, 'recoloured': 0, 'bytes': 0,
+            'changed': False, 'skipped': False, 'cache': None, 'histograms': None, 'error': None,
+            'reused': 0, 'timings': {}}
+
+def recolour_variants(in_path, variants, cache=None, colour_index=None, frm=None, write=None, timings=None,
+                      memo=None):
+    # Read and index one file once, then write it out recoloured with each
+    # (output path, table) in variants. Returns a result record per variant.
+    # An already opened FrmFile can be passed as frm (with the timings of
+    # opening it), and write replaces write_output, eg to hand the writing to
+    # another thread. memo is a dedup.FrameMemo shared by the whole run.
+    results = [new_result(in_path, out_path) for out_path, _ in variants]
+    timer = StageTimer(timings)
+    try:
+        if frm is None:
+            with timer.stage('read'):
+                mm = map_file(in_path)
+            with timer.stage('index'):
+                frm = FrmFile(mm, frm_is_single_direction(frm_type_of(in_path)), in_path)
+        with frm:
+            histograms = source = None
+            for result, (out_path, table) in zip(results, variants):
+                result['frames'] = len(frm)
+                result['bytes'] = len(frm.data)
+                try:
+                    histograms, source = recolour_variant(frm, result, table, cache, colour_index,
+                                                          histograms, source, write or write_output, timer, memo)
+                except Exception as e:
+                    result['error'] = f"{type(e).__name__}: {e}"
+                    result['cache'] = None
+                result['timings'] = timer.take()
+    except Exception as e:
+        for result in results:
+            result['error'] = f"{type(e).__name__}: {e}"
+        results[0]['timings'] = timer.take()
+    return results
+
+def recolour_variant(frm, result, table, cache, colour_index, histograms, source, write, timer, memo=None):
+    # One output of recolour_variants. histograms and source carry what was
+    # worked out about the input for the first variant over to the others.
+    in_path, out_path = result['path'], result['output']
+    if cache is not None:
+        with timer.stage('cache'):
+            record, up_to_date = cache.lookup(frm, out_path, table, source)
+            source = (record['input'], record['colours'])
+            result['cache'] = record
+            if up_to_date:
+                result['skipped'] = True
+                return histograms, source
+            os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+            if cache.restore(record['key'], out_path):
+                result['changed'] = not np.array_equal(np.fromfile(out_path, np.uint8), frm.data)
+                return histograms, source
+    frames = None
+    if colour_index is not None:
+        # Only frames holding a colour the table changes need recolouring
+        with timer.stage('histogram'):
+            if histograms is None:
+                histograms = colour_index.lookup(in_path)
+            if histograms is None:
+                histograms = frame_histograms(frm)
+                result['histograms'] = colour_index.entry(in_path, histograms)
+            frames = frames_to_recolour(histograms, table)
+    with timer.stage('recolour'):
+        hits = memo.hits if memo is not None else 0
+        outdata = recolour_frm(frm, table, frames, memo)
+        result['recoloured'] = len(frm) if frames is None else len(frames)
+        result['reused'] = memo.hits - hits if memo is not None else 0
+        result['changed'] = not np.array_equal(outdata, frm.data)
+    with timer.stage('write'):
+        write(result, outdata, cache)
+    return histograms, source
+
+def write_output(result, outdata, cache=None):
+    out_path = result['output']
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, "wb") as o:
+        o.write(outdata)
+    if cache is not None:
+        cache.store(result['cache']['key'], outdata)
+
+_worker_func = None
+_worker_args = None
+
+def _init_worker(func, args):
+    global _worker_func, _worker_args
+    _worker_func, _worker_args = func, args
+
+def _worker_job(item):
+    return _worker_func(item, *_worker_args)
+
+def pool_map(func, items, args=(), workers=None, chunksize=8):
+    # Yields func(item, *args) for each item in the order they finish, spread
+    # over a pool of worker processes. workers=None uses one process per core,
+    # workers=1 runs in this process. func must be a module-level function;
+    # args are sent to each worker once, so anything in them that keeps state
+    # (eg a FrameMemo) is kept per worker.
+    if workers == 1 or len(items) <= 1:
+        for item in items:
+            yield func(item, *args)
+        return
+    with Pool(workers, initializer=_init_worker, initargs=(func, args)) as pool:
+        yield from pool.imap_unordered(_worker_job, items, chunksize)
+
+def _recolour_job(job, tables, cache, colour_index, memo):
+    return recolour_variants(job[0], list(zip(job[1], tables)), cache, colour_index, memo=memo)
+
+def recolour_folder(indir, outdir, table, workers=None, chunksize=8, recursive=True, cache=None,
+                    colour_index=None, dedup=False):
+    # Recolour every FRM under indir into the same layout under outdir
+    return recolour_folder_variants(indir, [(outdir, table)], workers, chunksize, recursive,
+                                    cache, colour_index, dedup)
+
+def recolour_folder_variants(indir, variants, workers=None, chunksize=8, recursive=True, cache=None,
+                             colour_index=None, dedup=False):
+    # Recolour every FRM under indir once per (output folder, table) in
+    # variants, each into the same layout under its folder
+    jobs = [(os.path.join(indir, rel), [os.path.join(outdir, rel) for outdir, _ in variants])
+            for rel in find_frm_files(indir, recursive)]
+    return recolour_files_variants(jobs, [table for _, table in variants], workers, chunksize,
+                                   cache, colour_index, dedup)
+
+def recolour_files(jobs, table, workers=None, chunksize=8, cache=None, colour_index=None, dedup=False):
+    # Recolour each (input path, output path) job
+    return recolour_files_variants([(in_path, [out_path]) for in_path, out_path in jobs], [table],
+                                   workers, chunksize, cache, colour_index, dedup)
+
+def recolour_files_variants(jobs, tables, workers=None, chunksize=8, cache=None, colour_index=None,
+                            dedup=False):
+    # Each job is (input path, [output path per table]); every input is read
+    # and indexed once however many tables it is recoloured with.
+    # Yields one result record per output as soon as its file finishes;
+    # workers and chunksize are as for pool_map. With a RecolourCache, outputs
+    # that are already up to date are skipped and the cache index is saved
+    # once every file is done. A ColourIndex lets files and frames without any
+    # mapped colour be copied through as they are; new histograms found along
+    # the way are added to it at the end. With dedup, frames identical to one
+    # already recoloured reuse its result.
+    memo = FrameMemo() if dedup else None
+    results = pool_map(_recolour_job, jobs, (tables, cache, colour_index, memo), workers, chunksize)
+    try:
+        yield from collect_results(results, cache, colour_index)
+    finally:
+        results.close()
+
+def collect_results(results, cache=None, colour_index=None):
+    # Flatten per-file result lists, merging what the workers learned into
+    # the cache and colour index, which are saved once everything is done
+    histograms = []
+    try:
+        for file_results in results:
+            for result in file_results:
+                if cache is not None and result['cache']:
+                    cache.update(result['cache'])
+                if result['histograms']:
+                    histograms.append(result['histograms'])
+                yield result
+    finally:
+        if cache is not None:
+            cache.save()
+        if colour_index is not None:
+            colour_index.add(histograms)
+
+def recolour_dat(dat_path, table, outdir=None, out_dat=None, dedup=False):
+    # Stream the FRM entries of a DAT archive through the recolour table one
+    # at a time. Recoloured files are written under outdir, into a new archive
+    # out_dat, or both; a new archive also gets every other entry (and any FRM
+    # that failed) copied over exactly as stored.
+    memo = FrameMemo() if dedup else None
+    with DatArchive(dat_path) as dat, (DatWriter(out_dat) if out_dat else nullcontext()) as writer:
+        for entry in dat.entries:
+            name = entry['name']
+            if not is_frm_file(name):
+                if writer:
+                    writer.add_raw(entry, dat.raw(entry))
+                continue
+            out_path = os.path.join(outdir, *name.split('\\')) if outdir else None
+            result = new_result(name, out_path)
+            result['bytes'] = entry['size']
+            timer = StageTimer()
+            try:
+                with timer.stage('read'):
+                    data = dat.read(entry)
+                with timer.stage('index'):
+                    frm = FrmFile(data, frm_is_single_direction(frm_type_of(name)), name)
+                with timer.stage('recolour'):
+                    hits = memo.hits if memo is not None else 0
+                    outdata = recolour_frm(frm, table, memo=memo)
+                    result['frames'] = result['recoloured'] = len(frm)
+                    result['reused'] = memo.hits - hits if memo is not None else 0
+                    result['changed'] = not np.array_equal(outdata, frm.data)
+                del frm, data
+                with timer.stage('write'):
+                    if out_path:
+                        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                        with open(out_path, "wb") as o:
+                            o.write(outdata)
+                    if writer:
+                        writer.add(name, outdata, entry['compressed'])
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                if writer:
+                    writer.add_raw(entry, dat.raw(entry))
+            result['timings'] = timer.take()
+            yield result
+
+def summarise(results):
+    results = list(results)
+    failed = [r for r in results if r['error']]
+    return {
+        'files': len(results),
+        'failed': failed,
+        'unchanged': sum(1 for r in results if not r['error'] and not r['changed'] and not r['skipped']),
+        'skipped': sum(1 for r in results if r['skipped']),
+        'frames': sum(r['frames'] for r in results),
+        'recoloured': sum(r['recoloured'] for r in results),
+        'reused': sum(r.get('reused', 0) for r in results),
+        'bytes': sum(r['bytes'] for r in results),
+    }
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import platform
+import struct
+import tempfile
+import time
+import numpy as np
+from frm import FrmFile, build_frm, pack_frm, parse_frames, rebuild_frm
+from palette import load_palette, scale_image
+from recolour import RECOLOUR_CSV_PATH, load_recolour_table, recolour_frm
+
+# Times each stage of the FRM pipeline on synthetic files of different sizes,
+# frame counts and direction layouts, and prints the results as JSON:
+#   python benchmark.py --output bench.json
+# Every stage is run --repeat times and the fastest run is reported.
+
+SIZES = {
+    'small': (6, 24, 40),      # frames per direction, width, height
+    'medium': (12, 64, 96),
+    'large': (30, 160, 200),
+}
+LAYOUTS = {
+    'FRM': 6,          # six directions with their own data
+    'FRM-shared': 1,   # six directions all pointing at the same data
+    'FR0': 1,          # a single direction file
+}
+
+def synthetic_frm(fpd, width, height, layout, seed=0):
+    rng = np.random.default_rng(seed)
+    def direction():
+        return [rng.integers(0, 256, (height, width), dtype=np.uint8) for _ in range(fpd)]
+    if layout == 'FRM':
+        directions = [direction() for _ in range(6)]
+    elif layout == 'FRM-shared':
+        directions = [direction()] * 6
+    else:
+        directions = [direction()]
+    return pack_frm(directions).tobytes()
+
+def have_pillow():
+    # scale_image needs Pillow; its stage is left out without it
+    try:
+        import PIL
+    except ImportError:
+        return False
+    return True
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def stage(seconds, nbytes, frames):
+    return {
+        'seconds': seconds,
+        'mb_per_s': nbytes / seconds / 1e6 if seconds else None,
+        'frames_per_s': frames / seconds if seconds else None,
+    }
+
+def run_case(name, data, frm_type, table, render, tmpdir, repeat):
+    single = frm_type != 'FRM'
+    path = os.path.join(tmpdir, name + '.' + frm_type)
+    with open(path, "wb") as f:
+        f.write(data)
+    frm = FrmFile(data, single)
+    nbytes, frames = len(data), len(frm)
+    out_path = os.path.join(tmpdir, name + '.out')
+
+    def write():
+        with open(out_path, "wb") as o:
+            o.write(build_frm(frm))
+
+    stages = {
+        'header_parse': best_time(lambda: struct.unpack_from(">IHHH6h6h6II", data), repeat),
+        'index': best_time(lambda: FrmFile(data, single), repeat),
+        'open_mmap': best_time(lambda: FrmFile.open(path).close(), repeat),
+        'recolour': best_time(lambda: recolour_frm(frm, table), repeat),
+        'rebuild_write': best_time(write, repeat),
+    }
+    # The FrameStore functions used by the Recolour GUI, which holds frames as Frame records
+    header, gui_frames = parse_frames(data, frm_type)
+    stages['gui_parse_frames'] = best_time(lambda: parse_frames(data, frm_type), repeat)
+    stages['gui_rebuild_frm'] = best_time(lambda: rebuild_frm(header, gui_frames), repeat)
+    if render:
+        palette = load_palette()
+        stages['gui_scale_image'] = best_time(
+            lambda: [scale_image(f.pixels, f.width, f.height, palette) for f in gui_frames],
+            repeat)
+    return {
+        'name': name,
+        'type': frm_type,
+        'bytes': nbytes,
+        'frames': frames,
+        'stages': {key: stage(seconds, nbytes, frames) for key, seconds in stages.items()},
+    }
+
+def run(sizes=SIZES, layouts=LAYOUTS, repeat=5, include_render=True):
+    table = load_recolour_table(RECOLOUR_CSV_PATH)
+    render = include_render and have_pillow()
+    cases = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size, (fpd, width, height) in sizes.items():
+            for layout in layouts:
+                data = synthetic_frm(fpd, width, height, layout)
+                frm_type = 'FR0' if layout == 'FR0' else 'FRM'
+                cases.append(run_case(size + '-' + layout, data, frm_type, table, render, tmpdir, repeat))
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'render': render,
+        'cases': cases,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FRM parsing, recolouring, writing and rendering.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage, the fastest is kept")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=list(SIZES))
+    parser.add_argument("--no-render", action="store_true", help="skip the scale_image stage")
+    parser.add_argument("--output", help="write the JSON here instead of printing it")
+    args = parser.parse_args()
+
+    results = run({s: SIZES[s] for s in args.sizes}, LAYOUTS, args.repeat, not args.no_render)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
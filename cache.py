@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+CACHE_DIR = '.recolour_cache'
+DEFAULT_CACHE_BYTES = 1024 ** 3
+
+# On-disk cache for repeated batch runs. Recoloured files are stored by a key
+# made of the input file's hash plus a hash of the recolour table entries for
+# the colours that file actually uses, so editing a rule only changes the key
+# of files containing its source colour. The index also remembers which key
+# each output file was last written from, letting up-to-date outputs be
+# skipped without recolouring or rewriting them.
+#
+# Worker processes only read the cache; the records they produce come back on
+# their results and are merged and saved by the main process.
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def recolour_key(input_hash, colours, table, frm=None):
+    if not isinstance(table, np.ndarray):
+        return input_hash + hash_bytes(table.key_bytes(frm, colours))  # RegionRules
+    return input_hash + hash_bytes(table[colours].tobytes())
+
+class RecolourCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.colours = {}   # input hash -> palette indices used by that file
+        self.outputs = {}   # output path -> [key, size, mtime_ns]
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                self.colours = index['colours']
+                self.outputs = index['outputs']
+            except (ValueError, KeyError):
+                pass  # unreadable index, start again from an empty cache
+
+    def blob_path(self, key):
+        return os.path.join(self.cache_dir, 'objects', key[:2], key + '.frm')
+
+    def lookup(self, frm, out_path, table, source=None):
+        # Work out the cache key of one input file. Returns the record to merge
+        # back with update() and whether out_path already holds that result.
+        # source is the (input, colours) of an earlier record for the same file.
+        if source is not None:
+            input_hash, colours = source
+        else:
+            input_hash = hash_bytes(frm.data)
+            colours = self.colours.get(input_hash)
+        if colours is None:
+            colours = np.flatnonzero(frm.colour_counts()).tolist()
+        key = recolour_key(input_hash, colours, table, frm)
+        record = {'input': input_hash, 'colours': colours, 'key': key, 'output': out_path}
+        known = self.outputs.get(out_path)
+        if known and known[0] == key:
+            try:
+                st = os.stat(out_path)
+            except OSError:
+                return record, False
+            return record, known[1:] == [st.st_size, st.st_mtime_ns]
+        return record, False
+
+    def restore(self, key, out_path):
+        blob = self.blob_path(key)
+        if not os.path.exists(blob):
+            return False
+        shutil.copyfile(blob, out_path)
+        os.utime(blob)  # keeps recently used entries safe from eviction
+        return True
+
+    def store(self, key, outdata):
+        blob = self.blob_path(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = blob + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(outdata)
+        os.replace(tmp, blob)
+
+    def update(self, record):
+        self.colours[record['input']] = record['colours']
+        st = os.stat(record['output'])
+        self.outputs[record['output']] = [record['key'], st.st_size, st.st_mtime_ns]
+
+    def evict(self):
+        # Drop the least recently used stored files until under max_bytes
+        blobs = []
+        for root, dirs, files in os.walk(os.path.join(self.cache_dir, 'objects')):
+            for name in files:
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                blobs.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def save(self):
+        self.evict()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'colours': self.colours, 'outputs': self.outputs}, f)
+        os.replace(tmp, self.index_path)
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.colours = {}
+        self.outputs = {}
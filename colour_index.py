@@ -0,0 +1,154 @@
+import argparse
+import os
+import sqlite3
+import zlib
+import numpy as np
+from frm import FrmFile
+
+COLOUR_INDEX_PATH = 'colour_index.sqlite'
+
+# A single SQLite file holding the 256-bin palette index histogram of every
+# FRM seen so far, for the whole file and for each frame. Entries are tied to
+# the file's size and modification time and are recomputed when those change.
+# The batch recolour uses it to copy files and frames that contain none of
+# the mapped colours straight through.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    counts BLOB NOT NULL,
+    frames BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_colours (
+    path TEXT NOT NULL,
+    colour INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (colour, path)
+);
+CREATE INDEX IF NOT EXISTS file_colours_path ON file_colours (path);
+"""
+
+def frame_histograms(frm):
+    # One 256-bin row of palette index counts per indexed frame
+    histograms = np.zeros((len(frm), 256), np.uint32)
+    for i in range(len(frm)):
+        histograms[i] = frm.colour_counts(i)
+    return histograms
+
+def mapped_colours(table):
+    # Palette indices a recolour table (or any rule of a RegionRules) actually changes
+    if not isinstance(table, np.ndarray):
+        return table.mapped_colours()
+    return np.flatnonzero(table != np.arange(256))
+
+def frames_to_recolour(histograms, table):
+    return np.flatnonzero(histograms[:, mapped_colours(table)].any(axis=1))
+
+class ColourIndex:
+    def __init__(self, db_path=COLOUR_INDEX_PATH):
+        self.db_path = db_path
+        self._db = None
+
+    def __getstate__(self):
+        # Worker processes get the path and open their own connection
+        return {'db_path': self.db_path, '_db': None}
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def lookup(self, path):
+        # The frame histograms stored for path, or None if missing or stale
+        path = os.path.abspath(path)
+        row = self.db.execute("SELECT size, mtime_ns, frames FROM files WHERE path = ?",
+                              (path,)).fetchone()
+        if row is None:
+            return None
+        st = os.stat(path)
+        if (row[0], row[1]) != (st.st_size, st.st_mtime_ns):
+            return None
+        return np.frombuffer(zlib.decompress(row[2]), '<u4').reshape(-1, 256)
+
+    def entry(self, path, histograms):
+        # A record for add(), made where the histograms were computed
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns, histograms)
+
+    def add(self, entries):
+        with self.db:
+            for path, size, mtime_ns, histograms in entries:
+                counts = histograms.sum(axis=0, dtype=np.uint64)
+                self.db.execute("DELETE FROM file_colours WHERE path = ?", (path,))
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                (path, size, mtime_ns, counts.astype('<u8').tobytes(),
+                                 zlib.compress(histograms.astype('<u4').tobytes())))
+                self.db.executemany("INSERT INTO file_colours VALUES (?, ?, ?)",
+                                    [(path, int(c), int(counts[c])) for c in np.flatnonzero(counts)])
+
+    def scan(self, paths):
+        # Index any of paths that are missing or out of date. Returns how many
+        # were indexed and {path: error} for files that could not be read.
+        entries = []
+        failed = {}
+        for path in paths:
+            try:
+                if self.lookup(path) is None:
+                    with FrmFile.open(path) as frm:
+                        entries.append(self.entry(path, frame_histograms(frm)))
+            except (OSError, ValueError) as e:
+                failed[path] = f"{type(e).__name__}: {e}"
+        self.add(entries)
+        return len(entries), failed
+
+    def files_using(self, colour):
+        # [(path, pixel count)] of indexed files containing the palette index
+        return self.db.execute("SELECT path, count FROM file_colours WHERE colour = ? ORDER BY path",
+                               (int(colour),)).fetchall()
+
+    def file_counts(self, path):
+        # Pixel count of every palette index in an indexed file, or None
+        row = self.db.execute("SELECT counts FROM files WHERE path = ?",
+                              (os.path.abspath(path),)).fetchone()
+        return None if row is None else np.frombuffer(row[0], '<u8')
+
+if __name__ == "__main__":
+    from batch import find_frm_files
+    parser = argparse.ArgumentParser(description="Query which FRM files use a palette index, or which indices a file uses.")
+    parser.add_argument("colours", nargs="*", type=int, help="palette indices (0-255) to look up")
+    parser.add_argument("--scan", metavar="DIR", help="index every FRM under DIR first")
+    parser.add_argument("--file", metavar="FRM", action="append", default=[], help="list the palette indices an indexed file uses (repeatable)")
+    parser.add_argument("--db", default=COLOUR_INDEX_PATH, help="index file to use")
+    args = parser.parse_args()
+
+    index = ColourIndex(args.db)
+    if args.scan:
+        paths = [os.path.join(args.scan, rel) for rel in find_frm_files(args.scan)]
+        indexed, failed = index.scan(paths)
+        for path, error in failed.items():
+            print("FAILED "+path+": "+error)
+        print("Indexed "+str(indexed)+" of "+str(len(paths))+" files.")
+    for colour in args.colours:
+        files = index.files_using(colour)
+        print("Index "+str(colour)+" is used by "+str(len(files))+" files:")
+        for path, count in files:
+            print("  "+path+" ("+str(count)+" pixels)")
+    for path in args.file:
+        counts = index.file_counts(path)
+        if counts is None:
+            print(path+" is not indexed, add it with --scan.")
+            continue
+        print(path+" uses "+str(np.count_nonzero(counts))+" palette indices:")
+        for colour in np.flatnonzero(counts):
+            print("  "+str(colour)+" ("+str(counts[colour])+" pixels)")
+    index.close()
@@ -0,0 +1,104 @@
+import mmap
+import struct
+import zlib
+
+# Fallout 2 DAT archives (master.dat, critter.dat, patch000.dat). Layout, all
+# little-endian:
+#   file data, stored raw or zlib-compressed, one entry after another
+#   directory tree: file count, then for every file its name length, name
+#   (backslash separated), compressed flag, real size, packed size, offset
+#   tree size (including the file count) and total archive size
+# Fallout 1 archives use a different, LZSS based format and are not read.
+
+class DatArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mmap
+        if len(mm) < 12:
+            raise ValueError(f"{path} is too short to be a DAT archive")
+        tree_size, data_size = struct.unpack_from("<II", mm, len(mm) - 8)
+        if data_size != len(mm) or tree_size + 8 > len(mm):
+            raise ValueError(f"{path} is not a Fallout 2 DAT archive")
+        pos = len(mm) - 8 - tree_size
+        count = struct.unpack_from("<I", mm, pos)[0]
+        pos += 4
+        self.entries = []
+        for _ in range(count):
+            name_size = struct.unpack_from("<I", mm, pos)[0]
+            name = mm[pos + 4:pos + 4 + name_size].decode("ascii")
+            pos += 4 + name_size
+            compressed, size, packed_size, offset = struct.unpack_from("<BIII", mm, pos)
+            pos += 13
+            self.entries.append({
+                'name': name,
+                'compressed': bool(compressed),
+                'size': size,
+                'packed_size': packed_size,
+                'offset': offset
+            })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # entry views are still alive, the mapping goes when they do
+
+    def raw(self, entry):
+        # The entry's bytes as stored, without decompressing them
+        return memoryview(self._mmap)[entry['offset']:entry['offset'] + entry['packed_size']]
+
+    def read(self, entry):
+        # Uncompressed entries come back as a view of the archive, others are
+        # decompressed into a buffer of their own
+        data = self.raw(entry)
+        if entry['compressed']:
+            data = zlib.decompress(data, bufsize=entry['size'])
+        return data
+
+class DatWriter:
+    # Writes entries one at a time, then the directory tree on close()
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_raw(self, entry, raw):
+        # Copy an entry from another archive exactly as it was stored
+        offset = self.file.tell()
+        self.file.write(raw)
+        self.entries.append(dict(entry, offset=offset, packed_size=len(raw)))
+
+    def add(self, name, data, compress=True):
+        size = len(data)
+        if compress:
+            data = zlib.compress(data)
+        self.add_raw({'name': name, 'compressed': compress, 'size': size}, data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        tree = [struct.pack("<I", len(self.entries))]
+        for entry in self.entries:
+            name = entry['name'].encode("ascii")
+            tree.append(struct.pack("<I", len(name)) + name)
+            tree.append(struct.pack("<BIII", entry['compressed'], entry['size'],
+                                    entry['packed_size'], entry['offset']))
+        tree = b''.join(tree)
+        self.file.write(tree)
+        self.file.write(struct.pack("<II", len(tree), self.file.tell() + 8))
+        self.file.close()
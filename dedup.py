@@ -0,0 +1,45 @@
+import hashlib
+from collections import OrderedDict
+
+DEFAULT_MEMO_BYTES = 256 * 1024 ** 2
+
+# Critter sets repeat the same frames across directions, animations and
+# armour variants. A FrameMemo remembers the recoloured pixels of every frame
+# seen in a run by a hash of its pixels and size, so each distinct frame is
+# only recoloured once and copies reuse the result. With a plain table the
+# hash costs about as much as the lookup it saves; region rules (regions.py)
+# are where it pays off. Each worker process keeps its own memo.
+
+class FrameMemo:
+    def __init__(self, max_bytes=DEFAULT_MEMO_BYTES):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()  # key -> recoloured pixels
+        self.tables = {}  # id(table) -> (table, number); holding the table keeps its id unique
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def table_number(self, table):
+        entry = self.tables.get(id(table))
+        if entry is None:
+            entry = self.tables[id(table)] = (table, len(self.tables))
+        return entry[1]
+
+    def recolour(self, pixels, table, recolour, context=()):
+        # recolour() the first time a frame of these pixels, shape and context
+        # is seen with this table, the remembered result after that
+        digest = hashlib.sha1(pixels, usedforsecurity=False).digest()
+        key = (self.table_number(table), pixels.shape, context, digest)
+        out = self.frames.get(key)
+        if out is not None:
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return out
+        out = recolour()
+        self.misses += 1
+        self.frames[key] = out
+        self.bytes += out.nbytes
+        while self.bytes > self.max_bytes and len(self.frames) > 1:
+            _, old = self.frames.popitem(last=False)
+            self.bytes -= old.nbytes
+        return out
@@ -0,0 +1,149 @@
+import csv
+import json
+import numpy as np
+from batch import pool_map
+from colour_index import frame_histograms
+from dat import DatArchive
+from frm import FrmFile, frm_is_single_direction, frm_type_of, is_frm_file
+
+# What a recolour would do, without writing anything: for every file and
+# frame, how many pixels each line of the mapping file would change and
+# whether the file would come out identical. Plain mappings are worked out
+# from the frames' colour histograms alone, pushing each rule through all of
+# a file's histograms at once; rules limited to part of the frames (see
+# regions.py) count the pixels inside each region the same way.
+#
+# A report holds one record per file:
+#   {'path', 'frames', 'pixels', 'changed', 'rules': [pixels changed per rule],
+#    'frame_changes': [[frame, width, height, changed, per rule...], ...], 'error'}
+# 'changed' counts pixels whose final colour differs from the input, so a
+# pixel moved by two rules in turn is counted once there but under both rules,
+# and one moved back to its own colour only under the rules.
+
+def rule_counts(histograms, rules):
+    # Pixels each (src, dst) rule changes, applied in order, for each row of
+    # histograms; returns the counts and the histograms after every rule
+    hist = np.array(histograms, np.int64, ndmin=2)
+    counts = np.zeros((len(hist), len(rules)), np.int64)
+    for k, (src, dst) in enumerate(rules):
+        if src == dst:
+            continue
+        moved = hist[:, src].copy()
+        counts[:, k] = moved
+        hist[:, dst] += moved
+        hist[:, src] = 0
+    return counts, hist
+
+def group_rules(rules):
+    # The (src, dst) pairs of each of rules.groups, in the same order
+    groups = []
+    for src, dst, where in rules.rules:
+        if not groups or groups[-1][0] != where:
+            groups.append((where, []))
+        groups[-1][1].append((src, dst))
+    return [pairs for _, pairs in groups]
+
+def diff_frm(frm, rules, histograms=None):
+    # (changed pixels per frame, pixels changed per rule per frame) of an
+    # FrmFile, from its frame histograms if every rule applies everywhere
+    if rules.is_global():
+        if histograms is None:
+            histograms = frame_histograms(frm)
+        counts, _ = rule_counts(histograms, [(src, dst) for src, dst, _ in rules.rules])
+        changed = np.asarray(histograms, np.int64)[:, rules.table != np.arange(256)].sum(axis=1)
+        return changed, counts
+    directions = rules.frame_directions(frm)
+    pairs = group_rules(rules)
+    changed = np.zeros(len(frm), np.int64)
+    counts = np.zeros((len(frm), len(rules.rules)), np.int64)
+    for i in range(len(frm)):
+        image = frm.frame_image(i)
+        out = np.array(image)
+        k = 0
+        for (where, table), group in zip(rules.groups, pairs):
+            region = rules.region(where, out, table, i, directions[i])
+            if region is not None:
+                inside = out[region]
+                counts[i, k:k + len(group)] = rule_counts(np.bincount(inside.ravel(), minlength=256), group)[0][0]
+                out[region] = table[inside]
+            k += len(group)
+        changed[i] = np.count_nonzero(out != image)
+    return changed, counts
+
+def diff_report(frm, rules, path, histograms=None):
+    changed, counts = diff_frm(frm, rules, histograms)
+    return {
+        'path': path,
+        'frames': len(frm),
+        'pixels': int(frm.sizes.sum()),
+        'changed': int(changed.sum()),
+        'rules': counts.sum(axis=0).tolist(),
+        'frame_changes': [[i, int(frm.widths[i]), int(frm.heights[i]), int(changed[i])] + counts[i].tolist()
+                          for i in range(len(frm))],
+        'error': None,
+    }
+
+def failed_report(path, rules, e):
+    return {'path': path, 'frames': 0, 'pixels': 0, 'changed': 0, 'rules': [0] * len(rules.rules),
+            'frame_changes': [], 'error': f"{type(e).__name__}: {e}"}
+
+def diff_file(path, rules, colour_index=None):
+    # Never raises; a file that can't be read gets a report with its error.
+    # A ColourIndex saves reading the pixels of files it already has.
+    try:
+        with FrmFile.open(path) as frm:
+            histograms = colour_index.lookup(path) if colour_index is not None and rules.is_global() else None
+            return diff_report(frm, rules, path, histograms)
+    except Exception as e:
+        return failed_report(path, rules, e)
+
+def diff_dat(dat_path, rules):
+    # Reports for the FRM entries of a DAT archive, read one at a time
+    with DatArchive(dat_path) as dat:
+        for entry in dat.entries:
+            name = entry['name']
+            if not is_frm_file(name):
+                continue
+            try:
+                frm = FrmFile(dat.read(entry), frm_is_single_direction(frm_type_of(name)), name)
+                yield diff_report(frm, rules, name)
+                del frm
+            except Exception as e:
+                yield failed_report(name, rules, e)
+
+def diff_files(paths, rules, workers=None, chunksize=8, colour_index=None):
+    # Yields a report per file as each one finishes (see batch.pool_map)
+    return pool_map(diff_file, paths, (rules, colour_index), workers, chunksize)
+
+def rule_names(rules):
+    return [f"{src},{dst}" + "".join("," + key + "=" + value for key, value in where) for src, dst, where in rules.rules]
+
+def write_report(reports, report_path, rules):
+    # JSON (the records above, plus totals) or, for a .csv path, one row per
+    # frame with a column per rule
+    reports = sorted(reports, key=lambda r: r['path'])
+    names = rule_names(rules)
+    if report_path.lower().endswith(".csv"):
+        with open(report_path, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'frame', 'width', 'height', 'changed'] + names)
+            for report in reports:
+                for row in report['frame_changes']:
+                    writer.writerow([report['path']] + row)
+        return
+    totals = np.sum([r['rules'] for r in reports], axis=0).tolist() if reports else [0] * len(names)
+    with open(report_path, "w") as f:
+        json.dump({'rules': names, 'rule_totals': totals, 'files': reports}, f, separators=(",", ":"))
+
+def summarise_reports(reports):
+    reports = list(reports)
+    ok = [r for r in reports if not r['error']]
+    return {
+        'files': len(reports),
+        'failed': [r for r in reports if r['error']],
+        'unchanged': [r['path'] for r in ok if not r['changed']],
+        'frames': sum(r['frames'] for r in ok),
+        'changed_frames': sum(1 for r in ok for row in r['frame_changes'] if row[3]),
+        'pixels': sum(r['pixels'] for r in ok),
+        'changed': sum(r['changed'] for r in ok),
+    }
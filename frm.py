@@ -0,0 +1,289 @@
+import mmap
+import os
+import struct
+import numpy as np
+
+FRM_HEADER_SIZE = 62
+FRAME_HEADER_SIZE = 12
+SINGLE_DIRECTION_TYPES = {"FR0", "FR1", "FR2", "FR3", "FR4", "FR5"}
+FRM_TYPES = SINGLE_DIRECTION_TYPES | {"FRM"}
+
+# FRM layout (all values big-endian):
+#   62 byte file header: version, fps, action frame, frames per direction,
+#   x/y shifts and data offsets for the 6 directions, size of the frame data.
+#   Each frame is then a 12 byte header (width, height, size, x/y offset)
+#   followed by width*height palette indices.
+# Direction data offsets are relative to the end of the file header. An FRM
+# with fewer than 6 distinct directions points several of them at the same
+# data; FR0-FR5 files hold a single direction.
+
+def frm_type_of(path):
+    return os.path.splitext(path)[1][1:].upper()
+
+def frm_is_single_direction(frm_type):
+    return frm_type.upper() in SINGLE_DIRECTION_TYPES
+
+def is_frm_file(path):
+    return frm_type_of(path) in FRM_TYPES
+
+def map_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class FrmFile:
+    # Read-only view of an FRM/FR0-FR5 file. Opening one walks the frame
+    # headers once to build an offset/width/height index; frames are then
+    # handed out as NumPy views of the underlying buffer, never copied.
+    # Frames are numbered across the distinct direction blocks only, so data
+    # shared by several directions appears (and gets recoloured) once.
+
+    def __init__(self, data, single_direction=False, path=None):
+        self.path = path
+        self._mmap = data if isinstance(data, mmap.mmap) else None
+        self.data = np.frombuffer(data, np.uint8)
+        if len(self.data) < FRM_HEADER_SIZE:
+            raise ValueError("file is too short to hold an FRM header")
+        self.header = self.data[:FRM_HEADER_SIZE]
+        self.frames_per_direction = struct.unpack_from(">H", data, 8)[0]
+        self.single_direction = single_direction
+        self.build_index(data)
+
+    @classmethod
+    def open(cls, path, single_direction=None):
+        if single_direction is None:
+            single_direction = frm_is_single_direction(frm_type_of(path))
+        return cls(map_file(path), single_direction, path)
+
+    def build_index(self, data):
+        # Directions whose data offsets are equal share one block of frames;
+        # each distinct block is indexed once, in file order.
+        direction_offsets = struct.unpack_from(">6I", data, 34)
+        if self.single_direction:
+            direction_offsets = direction_offsets[:1]
+        self.blocks = sorted(set(direction_offsets))
+        self.directions = [self.blocks.index(o) for o in direction_offsets]
+        fpd = self.frames_per_direction
+        count = len(self.blocks) * fpd
+        offsets = np.empty(count, np.int64)
+        widths = np.empty(count, np.int64)
+        heights = np.empty(count, np.int64)
+        sizes = np.empty(count, np.int64)
+        length = len(self.data)
+        end = FRM_HEADER_SIZE
+        for b, block_offset in enumerate(self.blocks):
+            offset = FRM_HEADER_SIZE + block_offset
+            for i in range(b * fpd, (b + 1) * fpd):
+                if offset + FRAME_HEADER_SIZE > length:
+                    raise ValueError(f"frame {i} header runs past the end of the file")
+                width, height, size = struct.unpack_from(">HHI", data, offset)
+                offsets[i] = offset
+                widths[i] = width
+                heights[i] = height
+                sizes[i] = size
+                offset += FRAME_HEADER_SIZE + size
+                if offset > length:
+                    raise ValueError(f"frame {i} pixel data runs past the end of the file")
+            end = max(end, offset)
+        self.offsets = offsets
+        self.widths = widths
+        self.heights = heights
+        self.sizes = sizes
+        self.end = end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self.data = self.header = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # frame views are still alive, the mapping goes when they do
+        self._mmap = None
+
+    def frame_header(self, i):
+        start = self.offsets[i]
+        return self.data[start:start + FRAME_HEADER_SIZE]
+
+    def frame_slice(self, i):
+        start = self.offsets[i] + FRAME_HEADER_SIZE
+        return slice(start, start + self.sizes[i])
+
+    def frame(self, i):
+        return self.data[self.frame_slice(i)]
+
+    def frame_image(self, i):
+        return self.frame(i).reshape(self.heights[i], self.widths[i])
+
+    def direction_frames(self, direction):
+        # Frame numbers holding the given direction (0-5, or 0 for FR0-FR5)
+        start = self.directions[direction] * self.frames_per_direction
+        return range(start, start + self.frames_per_direction)
+
+    def frames(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def colour_counts(self, i=None):
+        # 256-bin histogram of the palette indices in frame i, or in every frame
+        if i is not None:
+            return np.bincount(self.frame(i), minlength=256)
+        counts = np.zeros(256, np.int64)
+        for pixels in self.frames():
+            counts += np.bincount(pixels, minlength=256)
+        return counts
+
+def build_frm(frm, frames=None):
+    # Reassemble a file into one preallocated buffer. frames gives the new
+    # pixels for each indexed frame in order (default: the file's own); they
+    # must keep their sizes, anything else in the file is carried over as is.
+    out = frm.data.copy()
+    if frames is not None:
+        for i, pixels in enumerate(frames):
+            out[frm.frame_slice(i)] = pixels
+    return out
+
+def pack_frm(directions, fps=10, action_frame=0, shifts=None):
+    # Build a new FRM from scratch. directions holds 1 (FR0-FR5, or an FRM
+    # facing one way) or 6 lists of frames; passing the same list object for
+    # several directions stores its frames once and shares them. A frame is a
+    # 2-D array of palette indices, or (array, x offset, y offset). shifts
+    # gives the (x, y) shift of each direction.
+    fpd = len(directions[0])
+    shifts = list(shifts or [(0, 0)] * 6) + [(0, 0)] * (6 - len(directions))
+    blocks = []
+    offsets = []
+    size = 0
+    for frames in directions:
+        for block, offset in blocks:
+            if block is frames:
+                offsets.append(offset)
+                break
+        else:
+            if len(frames) != fpd:
+                raise ValueError("every direction needs the same number of frames")
+            offsets.append(size)
+            blocks.append((frames, size))
+            for frame in frames:
+                image = frame[0] if isinstance(frame, tuple) else frame
+                size += FRAME_HEADER_SIZE + np.asarray(image).size
+    offsets += [offsets[0]] * (6 - len(offsets))
+    out = np.empty(FRM_HEADER_SIZE + size, np.uint8)
+    struct.pack_into(">IHHH6h6h6II", out, 0, 4, fps, action_frame, fpd,
+                     *[x for x, _ in shifts[:6]], *[y for _, y in shifts[:6]], *offsets, size)
+    pos = FRM_HEADER_SIZE
+    for frames, _ in blocks:
+        for frame in frames:
+            image, x, y = frame if isinstance(frame, tuple) else (frame, 0, 0)
+            image = np.asarray(image, dtype=np.uint8)
+            height, width = image.shape
+            struct.pack_into(">HHIhh", out, pos, width, height, image.size, x, y)
+            pos += FRAME_HEADER_SIZE
+            out[pos:pos + image.size] = image.reshape(-1)
+            pos += image.size
+    return out
+
+# Frame stores, as edited by the Recolour GUI: one buffer per file with a
+# record per indexed frame holding its offset, size, shifts and 2-D pixels.
+
+class Frame:
+    # One frame of a FrameStore. pixels is a 2-D view into the store's
+    # buffer, so editing it edits the store.
+    __slots__ = ('offset', 'width', 'height', 'shift_x', 'shift_y', 'pixels')
+
+    def __init__(self, offset, width, height, shift_x, shift_y, pixels):
+        self.offset = offset
+        self.width = width
+        self.height = height
+        self.shift_x = shift_x
+        self.shift_y = shift_y
+        self.pixels = pixels
+
+class FrameStore:
+    # Editable frames of a whole file for the Recolour GUI: one writable
+    # copy of the file data, with a small Frame record per frame pointing
+    # into it. Copying the store copies the buffer once, and saving writes it
+    # back as it is, since frames never change size.
+    __slots__ = ('data', 'end', 'frames')
+
+    def __init__(self, data, frm):
+        self.data = data
+        self.end = frm.end
+        self.frames = []
+        for i in range(len(frm)):
+            start = int(frm.offsets[i])
+            width, height = int(frm.widths[i]), int(frm.heights[i])
+            shift_x, shift_y = struct.unpack_from(">hh", data, start + 8)
+            pixels = data[start + FRAME_HEADER_SIZE:start + FRAME_HEADER_SIZE + width * height]
+            self.frames.append(Frame(start, width, height, shift_x, shift_y, pixels.reshape(height, width)))
+
+    @classmethod
+    def parse(cls, frm_bytes, frm_type):
+        data = np.array(np.frombuffer(frm_bytes, np.uint8))
+        return cls(data, FrmFile(data, frm_is_single_direction(frm_type)))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    @property
+    def header(self):
+        return self.data[:FRM_HEADER_SIZE].tobytes()
+
+    def copy(self):
+        store = FrameStore.__new__(FrameStore)
+        store.data = self.data.copy()
+        store.end = self.end
+        store.frames = [Frame(f.offset, f.width, f.height, f.shift_x, f.shift_y,
+                              store.data[f.offset + FRAME_HEADER_SIZE:
+                                         f.offset + FRAME_HEADER_SIZE + f.pixels.size].reshape(f.pixels.shape))
+                        for f in self.frames]
+        return store
+
+    def patches(self, frames):
+        # (file offset, pixel bytes) of the given frame numbers, to write over
+        # a saved copy of the file with patch_file
+        return [(f.offset + FRAME_HEADER_SIZE, f.pixels.tobytes()) for f in (self.frames[i] for i in sorted(frames))]
+
+    def tobytes(self, header=None):
+        # The file as it is now, up to the end of the last frame
+        data = self.data[:self.end]
+        if header is not None and bytes(header) != data[:len(header)].tobytes():
+            data = data.copy()
+            data[:len(header)] = np.frombuffer(header, np.uint8)
+        return data.tobytes()
+
+def parse_frames(frm_bytes, frm_type):
+    store = FrameStore.parse(frm_bytes, frm_type)
+    return store.header, store
+
+def copy_frames(frames):
+    return frames.copy()
+
+def rebuild_frm(header, frames):
+    # Frames are stored at the offsets they were read from, which keeps
+    # directions that share data pointing at a single copy of it
+    return frames.tobytes(header)
+
+def patch_file(path, patches):
+    # Write (offset, bytes) patches into an existing file in place, through a
+    # memory map, leaving the rest of it untouched
+    if not patches:
+        return
+    with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0) as mm:
+        for offset, data in patches:
+            mm[offset:offset + len(data)] = data
+        mm.flush()
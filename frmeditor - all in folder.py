@@ -1,111 +1,127 @@
-import numpy as np
-import os
+from batch import find_frm_files, recolour_dat, recolour_files_variants, summarise
+from cache import RecolourCache
+from colour_index import ColourIndex
+from dryrun import diff_dat, diff_files, summarise_reports, write_report
+from instrument import stage_table, write_log
+from pipeline import pipelined_recolour
+from recolour import load_recolour_table
+from regions import load_region_rules
+from validate import print_reports, validate_files
+from watch import Watcher
 
 
 indir = "./My Input Folder/" # The directory of the files you want to read in. The "./" indicates the folder you are running this script from. Keep the / at the end.
 outdir = "./My Output Folder/" # Where to save the output files after recolouring. Keep the / at the end.
 
+indat = None # Set to a Fallout 2 .DAT archive, eg "./critter.dat", to recolour the FRMs inside it instead of the ones in indir. They are saved into outdir, keeping the folders they have in the archive.
+outdat = None # Set to a new .DAT file to also save a copy of indat with the FRMs recoloured. Set outdir to None to only make the new .DAT.
 
+recolourfile = "recolour.txt" # The colour replacements to make, one "from,to" pair of palette indices (0-255, ie index on the color.pal palette) per line.
+# In the example recolour.txt every green pixel is replaced with a similar shade of orange, eg "219,151" turns 219 (dark green) into 151 (dark orange).
+# Use as many or as few lines as you need. They are applied in order, top to bottom.
+# A line can also be limited to part of each frame, eg "219,151,rect=10:0:40:25" or "219,151,mask=armour": see regions.py.
 
-directory = os.fsencode(indir)
-for file in os.listdir(directory):
-    filename = os.fsdecode(file)
-    if filename.endswith(".FRM") or filename.endswith(".FR0") or filename.endswith(".FR1") or filename.endswith(".FR2") or filename.endswith(".FR3") or filename.endswith(".FR4") or filename.endswith(".FR5") or filename.endswith(".frm") or filename.endswith(".fr0") or filename.endswith(".fr1") or filename.endswith(".fr2") or filename.endswith(".fr3") or filename.endswith(".fr4") or filename.endswith(".fr5"):
+variants = {} # To make several colour variants in one go, list more recolour files and the folder each one's output goes in, eg {"blue.txt": "./Blue Output Folder/", "red.txt": "./Red Output Folder/"}.
+# Every file is only read once however many variants there are. Not used with indat.
 
-        with open(str(indir)+str(filename),"r+b") as f:
-            frm = f.read()
-        f.close()
-        wholefrm=np.frombuffer(frm, np.uint8)
-        print(np.shape(wholefrm))
-        print(np.max(wholefrm))
-        header = wholefrm[0:62]
-        framedata = wholefrm[62:len(wholefrm)]
-        if filename.endswith(".FRM") or filename.endswith(".frm"):
-            numframes = 6*(int(header[8])*256+int(header[9]))
+dryrun = False # Set to true to save nothing and only print how many pixels recolourfile would change. Quick to run, to try a mapping out before a long run.
+reportfile = None # With dryrun, set to a file name, eg "./recolour_report.csv" (or .json), to save how many pixels each line of recolourfile changes in every file and frame.
+
+watch = False # Set to true to keep running after recolouring indir, and recolour files as they are added to or changed in indir, or when recolourfile changes. Stop it with Ctrl+C. Not used with indat or variants.
+watchinterval = 1.0 # With watch, how many seconds between looks at indir and recolourfile.
+watchsettle = 2.0 # With watch, how many seconds nothing must change for before the changes are recoloured, so files still being copied in are left until they are done.
+
+checkfirst = False # Set to true to check every file in indir for broken headers and frame sizes first. Nothing is recoloured if any broken files are found. "python validate.py" does the check on its own.
+
+recursive = True # Set to true to also recolour the files in every folder inside indir. The folder layout is copied into outdir.
+workers = None # How many files to recolour at once. None uses every core of your computer; 1 does one file at a time.
+chunksize = 8 # How many files each worker takes at a time. Larger numbers suit folders with lots of small files.
+
+dedup = False # Set to true to recolour frames that are exact copies of another frame (in any file) only once. Helps most with rules limited to part of the frames.
+
+pipeline = False # Set to true when the files are on a slow or network drive. Files are then read and saved in the background while others are recoloured, instead of using workers.
+readahead = 8 # With pipeline, how many files may be read in before they are recoloured.
+writebehind = 8 # With pipeline, how many recoloured files may wait to be saved. Lower these two if you run out of memory.
+iothreads = 2 # With pipeline, how many files are read and saved at the same time.
+
+logfile = None # Set to a file name, eg "./recolour_log.jsonl", to save a line of details and timings for every file.
+showstats = False # Set to true to print how long each step took in total, and the slowest files.
+
+usecache = True # Set to true to remember what was done last run, so files whose output is already up to date are skipped. After changing recolourfile only files using the changed colours are redone.
+cachedir = "./.recolour_cache/" # Where the cache is kept.
+cachesize = 1024 # The most disk space the cache may take up, in megabytes. The least recently used files are removed first.
+clearcache = False # Set to true to empty the cache before running, eg if output files were edited by hand.
+
+usecolourindex = True # Set to true to remember which colours every file and frame uses, so ones without any colour from recolourfile are copied instead of recoloured.
+colourindexfile = "./colour_index.sqlite" # Where that is kept. "python colour_index.py 219" lists the files that use colour 219.
+
+
+
+if __name__ == "__main__" and dryrun:
+    rules = load_region_rules(recolourfile)
+    if indat:
+        reports = list(diff_dat(indat, rules))
+    else:
+        colour_index = ColourIndex(colourindexfile) if usecolourindex else None
+        reports = list(diff_files([indir+rel for rel in find_frm_files(indir, recursive)], rules, workers, chunksize, colour_index))
+    if reportfile:
+        write_report(reports, reportfile, rules)
+    summary = summarise_reports(reports)
+    for report in summary['failed']:
+        print("FAILED "+report['path']+": "+report['error'])
+    print(str(summary['files'])+" files, "+str(summary['frames'])+" frames: "+str(summary['changed_frames'])+" frames and "+str(summary['changed'])+" pixels would change, "+str(len(summary['unchanged']))+" files would be identical to input, "+str(len(summary['failed']))+" failed.")
+    print("Dry run, nothing was saved.")
+
+elif __name__ == "__main__" and watch:
+    cache = RecolourCache(cachedir, cachesize*1024*1024) if usecache else None
+    colour_index = ColourIndex(colourindexfile) if usecolourindex else None
+    watcher = Watcher(indir, outdir, recolourfile, recursive, workers, chunksize, cache, colour_index, dedup)
+    print("Watching "+indir+" and "+recolourfile+", press Ctrl+C to stop.")
+    try:
+        watcher.run(watchinterval, watchsettle)
+    except KeyboardInterrupt:
+        print("Done!")
+
+elif __name__ == "__main__":
+    table = load_recolour_table(recolourfile)
+    cache = None
+    if usecache:
+        cache = RecolourCache(cachedir, cachesize*1024*1024)
+        if clearcache:
+            cache.clear()
+    colour_index = None
+    if usecolourindex:
+        colour_index = ColourIndex(colourindexfile)
+
+    if indat:
+        files = recolour_dat(indat, table, outdir, outdat, dedup)
+    else:
+        outputs = [(outdir, table)] + [(folder, load_recolour_table(mapfile)) for mapfile, folder in variants.items()]
+        tables = [t for _, t in outputs]
+        jobs = [(indir+rel, [folder+rel for folder, _ in outputs]) for rel in find_frm_files(indir, recursive)]
+        if checkfirst:
+            checked, broken = print_reports(validate_files([path for path, _ in jobs], workers), warnings=False)
+            if broken:
+                print(str(broken)+" of "+str(checked)+" files are broken, nothing was recoloured.")
+                raise SystemExit(1)
+        if pipeline:
+            files = pipelined_recolour(jobs, tables, cache, colour_index, iothreads, iothreads, readahead, writebehind, dedup)
         else:
-            numframes = (int(header[8])*256+int(header[9]))
-        print("Number of frames = "+str(numframes))
-        outdata = header
-
-        for frame in range(numframes):
-            framesize = int(framedata[4])*(256**3)+int(framedata[5])*(256**2)+int(framedata[6])*256+int(framedata[7])
-            print("Frame "+str(frame)+" size = "+str(framesize))
-            if frame < numframes-1:
-                currentframe = framedata[0:12+framesize]
-                framedata = framedata[12+framesize:len(framedata)]
-            else:
-                currentframe=framedata
-            frameheader = currentframe[0:12]
-            frameimage = currentframe[12:len(currentframe)]
-            
-            ## Begin lines to edit
-            
-            # These lines replace the pixel colours (numbers 0-255, ie index on the color.pal palette)
-            # In this example case I replace all green pixels with a similar shade of orange. Replace the numbers within the square brackets with the ones you want.
-            # Use as many or as few of these lines as you need; delete unwanted ones or copy and paste new ones. But make sure to preserve the indent or the code will break.
-            
-            frameimage = [151 if i==219 else i for i in frameimage] # This line takes every 219 (dark green) pixel in the frame and replaces it with 151 (dark orange)
-            frameimage = [150 if i==218 else i for i in frameimage] # This line does the same with a slightly different shade of green (218) and orange (150)
-            frameimage = [149 if i==217 else i for i in frameimage] # etc, etc
-            frameimage = [148 if i==216 else i for i in frameimage]
-            frameimage = [147 if i==215 else i for i in frameimage] # There are more shades of green than orange on the palette so I use the same shades of orange more than once. This may not be the case in your application.
-            frameimage = [151 if i==200 else i for i in frameimage]
-            frameimage = [146 if i==198 else i for i in frameimage]
-            frameimage = [145 if i==197 else i for i in frameimage]
-            frameimage = [144 if i==196 else i for i in frameimage]
-            frameimage = [155 if i==100 else i for i in frameimage]
-            frameimage = [154 if i==99 else i for i in frameimage]
-            frameimage = [153 if i==98 else i for i in frameimage]
-            frameimage = [152 if i==97 else i for i in frameimage]
-            frameimage = [151 if i==96 else i for i in frameimage]
-            frameimage = [152 if i==83 else i for i in frameimage]
-            frameimage = [151 if i==82 else i for i in frameimage]
-            frameimage = [150 if i==81 else i for i in frameimage]
-            frameimage = [149 if i==80 else i for i in frameimage]
-            frameimage = [155 if i==68 else i for i in frameimage]
-            frameimage = [154 if i==67 else i for i in frameimage]
-            frameimage = [153 if i==66 else i for i in frameimage]
-            frameimage = [152 if i==65 else i for i in frameimage]
-            frameimage = [151 if i==64 else i for i in frameimage]
-            frameimage = [152 if i==75 else i for i in frameimage]
-            frameimage = [151 if i==74 else i for i in frameimage]
-            frameimage = [150 if i==73 else i for i in frameimage]
-            frameimage = [149 if i==72 else i for i in frameimage]
-            frameimage = [148 if i==71 else i for i in frameimage]
-            frameimage = [147 if i==70 else i for i in frameimage]
-            frameimage = [146 if i==69 else i for i in frameimage]
-            frameimage = [154 if i==95 else i for i in frameimage]
-            frameimage = [153 if i==94 else i for i in frameimage]
-            frameimage = [152 if i==93 else i for i in frameimage]
-            frameimage = [151 if i==92 else i for i in frameimage]
-            frameimage = [150 if i==91 else i for i in frameimage]
-            frameimage = [149 if i==90 else i for i in frameimage]
-            frameimage = [148 if i==89 else i for i in frameimage]
-            frameimage = [149 if i==88 else i for i in frameimage]
-            frameimage = [148 if i==87 else i for i in frameimage]
-            frameimage = [147 if i==86 else i for i in frameimage]
-            frameimage = [151 if i==63 else i for i in frameimage]
-            frameimage = [150 if i==62 else i for i in frameimage]
-            frameimage = [149 if i==61 else i for i in frameimage]
-            frameimage = [148 if i==60 else i for i in frameimage]
-            frameimage = [147 if i==59 else i for i in frameimage]
-            
-            ## End lines to edit. Do not edit anything else unless you know what you're doing.
-
-            currentframe = np.append(frameheader,frameimage)
-            outdata = np.append(outdata, currentframe)
-
-        if np.sum(outdata - wholefrm)==0:
-            print("Output is identical to input.")
-        outdata=outdata.astype(np.uint8)
-        outdata = bytearray(outdata)
-
-        with open(str(outdir)+str(filename),"w+b") as o:
-            frm = o.write(outdata)
-        o.close()
-
-print("Done!")
-
-
-
-    
+            files = recolour_files_variants(jobs, tables, workers, chunksize, cache, colour_index, dedup)
+
+    if logfile:
+        files = write_log(files, logfile)
+
+    results = []
+    for result in files:
+        if result['error']:
+            print("FAILED "+result['path']+": "+result['error'])
+        results.append(result)
+
+    summary = summarise(results)
+    print(str(summary['files'])+" files, "+str(summary['frames'])+" frames, "+str(summary['recoloured'])+" recoloured ("+str(summary['skipped'])+" already up to date, "+str(summary['unchanged'])+" identical to input, "+str(len(summary['failed']))+" failed).")
+    if dedup:
+        print(str(summary['reused'])+" of "+str(summary['recoloured'])+" recoloured frames were copies of another frame.")
+    if showstats:
+        print(stage_table(results))
+    print("Done!")
@@ -0,0 +1,179 @@
+import argparse
+import glob
+import os
+import sys
+from batch import find_frm_files, recolour_dat, recolour_file, recolour_files_variants, summarise
+from cache import RecolourCache
+from colour_index import ColourIndex
+from dryrun import diff_dat, diff_files, summarise_reports, write_report
+from frm import is_frm_file
+from instrument import profile_call, stage_table, write_log
+from pipeline import IO_THREADS, READ_AHEAD, WRITE_BEHIND, pipelined_recolour
+from recolour import RECOLOUR_CSV_PATH, load_recolour_table
+from regions import load_region_rules
+from validate import print_reports, validate_files
+
+# Command line recolouring, for running without the GUI or editing the
+# settings at the top of the folder script:
+#   python frmrecolour.py "My Input Folder" -o "My Output Folder"
+#   python frmrecolour.py "art/critters/HMJMPS*.FR?" -o out -m orange.txt -j 8
+#   python frmrecolour.py critter.dat -o out --out-dat critter_orange.dat
+#   python frmrecolour.py art -o orange -m orange.txt --variant blue.txt blue
+#   python frmrecolour.py art -o orange --check
+#   python frmrecolour.py art -m orange.txt --dry-run --report orange.csv
+# Folders are searched for FRM/FR0-FR5 files, globs are expanded (** matches
+# any number of folders) and the folder layout under each input is kept in
+# the output folder. Only NumPy is needed; tkinter and Pillow are not loaded.
+
+def has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+def glob_root(pattern):
+    # The folder part of a glob before its first wildcard
+    parts = pattern.replace("\\", "/").split("/")
+    root = []
+    for part in parts[:-1]:
+        if has_magic(part):
+            break
+        root.append(part)
+    return "/".join(root) or "."
+
+def expand_inputs(inputs, recursive=True):
+    # (input path, output path relative to the output folder) of every FRM
+    # named by inputs
+    for item in inputs:
+        if os.path.isdir(item):
+            for rel in find_frm_files(item, recursive):
+                yield os.path.join(item, rel), rel
+        elif has_magic(item):
+            root = glob_root(item)
+            for path in sorted(glob.glob(item, recursive=True)):
+                if is_frm_file(path) and os.path.isfile(path):
+                    yield path, os.path.relpath(path, root)
+        else:
+            yield item, os.path.basename(item)
+
+def dedup_line(summary):
+    share = summary['reused'] / summary['recoloured'] if summary['recoloured'] else 0.0
+    return (str(summary['reused'])+" of "+str(summary['recoloured'])+" recoloured frames were copies of another frame"
+            " ("+format(share, ".1%")+" deduplicated).")
+
+def dry_run(args, dats, files):
+    rules = load_region_rules(args.map)
+    colour_index = ColourIndex(args.colour_index) if args.colour_index else None
+    reports = []
+    for dat in dats:
+        reports += diff_dat(dat, rules)
+    reports += diff_files([path for path, _ in expand_inputs(files, args.recursive)], rules, args.workers,
+                          args.chunksize, colour_index)
+    if args.report:
+        write_report(reports, args.report, rules)
+    summary = summarise_reports(reports)
+    for report in summary['failed']:
+        print("FAILED "+report['path']+": "+report['error'], file=sys.stderr)
+    share = summary['changed'] / summary['pixels'] if summary['pixels'] else 0.0
+    print(str(summary['files'])+" files, "+str(summary['frames'])+" frames: "+str(summary['changed_frames'])+" frames and "+str(summary['changed'])+" pixels ("+format(share, ".2%")+") would change, "+str(len(summary['unchanged']))+" files would be identical to input, "+str(len(summary['failed']))+" failed. Nothing was written.")
+    return 1 if summary['failed'] else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recolour Fallout FRM/FR0-FR5 files with a recolour.txt mapping.")
+    parser.add_argument("inputs", nargs="*", help="FRM files, folders, globs or Fallout 2 .DAT archives")
+    parser.add_argument("-o", "--output", help="folder to save the recoloured files in")
+    parser.add_argument("-m", "--map", default=RECOLOUR_CSV_PATH, help="recolour mapping file (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="files recoloured at once (default: one per core)")
+    parser.add_argument("--chunksize", type=int, default=8, help="files handed to a worker at a time")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="for slow or network drives: read and write files in background threads instead of using worker processes")
+    parser.add_argument("--read-ahead", type=int, default=READ_AHEAD, help="with --pipeline, files read in before they are recoloured")
+    parser.add_argument("--write-behind", type=int, default=WRITE_BEHIND, help="with --pipeline, recoloured files waiting to be saved")
+    parser.add_argument("--io-threads", type=int, default=IO_THREADS, help="with --pipeline, files read and saved at the same time")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", help="don't look inside subfolders of input folders")
+    parser.add_argument("--cache", metavar="DIR", help="skip files whose output is already up to date, remembered in DIR")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="with --cache, empty the cache first, eg if output files were edited by hand")
+    parser.add_argument("--colour-index", metavar="FILE", help="copy files and frames without any mapped colour, remembered in FILE")
+    parser.add_argument("--variant", nargs=2, action="append", default=[], metavar=("MAP", "FOLDER"),
+                        help="also recolour with MAP into FOLDER, reading each file only once (repeatable)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="recolour frames that are exact copies of one already done (in any file) only once")
+    parser.add_argument("--check", action="store_true",
+                        help="check the input files for broken headers first, and stop without recolouring if any are found")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="write nothing, just count the pixels each rule of the mapping would change")
+    parser.add_argument("--report", metavar="FILE", help="with --dry-run, save the counts per file and frame as JSON or .csv")
+    parser.add_argument("--log", metavar="FILE", help="save details and stage timings of every file as JSON lines")
+    parser.add_argument("--stats", action="store_true", help="print time per stage and the slowest files")
+    parser.add_argument("--profile", metavar="FRM", help="recolour just this one file into the -o folder under cProfile and print the profile")
+    parser.add_argument("--out-dat", metavar="FILE", help="with a .DAT input, also save a recoloured copy of the archive")
+    args = parser.parse_args(argv)
+
+    dats = [item for item in args.inputs if item.lower().endswith(".dat")]
+    files = [item for item in args.inputs if not item.lower().endswith(".dat")]
+    if args.profile:
+        table = load_recolour_table(args.map)
+        if not args.output:
+            parser.error("--profile needs an output folder (-o)")
+        out_path = os.path.join(args.output, os.path.basename(args.profile))
+        if os.path.realpath(out_path) == os.path.realpath(args.profile):
+            parser.error("--profile would overwrite its input, use another output folder")
+        result, stats = profile_call(recolour_file, args.profile, out_path, table)
+        print(stats)
+        return 1 if result['error'] else 0
+    if not args.inputs:
+        parser.error("no inputs given")
+    if args.out_dat and len(dats) != 1:
+        parser.error("--out-dat needs exactly one .DAT input")
+    if args.clear_cache and not args.cache:
+        parser.error("--clear-cache needs --cache")
+    if args.report and not args.dry_run:
+        parser.error("--report needs --dry-run")
+    if args.dry_run:
+        return dry_run(args, dats, files)
+    if not args.output and ((files and not args.variant) or (dats and not args.out_dat)):
+        parser.error("an output folder (-o) is needed")
+
+    table = load_recolour_table(args.map)
+    cache = colour_index = None
+    if args.cache:
+        cache = RecolourCache(args.cache)
+        if args.clear_cache:
+            cache.clear()
+    if args.colour_index:
+        colour_index = ColourIndex(args.colour_index)
+
+    outputs = [(args.output, table)] if args.output else []
+    outputs += [(folder, load_recolour_table(mapfile)) for mapfile, folder in args.variant]
+    jobs = [(path, [os.path.join(folder, rel) for folder, _ in outputs])
+            for path, rel in expand_inputs(files, args.recursive)]
+    if args.check:
+        checked, broken = print_reports(validate_files([path for path, _ in jobs], args.workers), False, sys.stderr)
+        if broken:
+            print(str(broken)+" of "+str(checked)+" files are broken, nothing was recoloured.")
+            return 1
+
+    results = []
+    for dat in dats:
+        results += recolour_dat(dat, table, args.output, args.out_dat, args.dedup)
+    if files:
+        tables = [t for _, t in outputs]
+        if args.pipeline:
+            results += pipelined_recolour(jobs, tables, cache, colour_index, args.io_threads, args.io_threads,
+                                          args.read_ahead, args.write_behind, args.dedup)
+        else:
+            results += recolour_files_variants(jobs, tables, args.workers, args.chunksize, cache, colour_index,
+                                               args.dedup)
+
+    if args.log:
+        results = list(write_log(results, args.log))
+    summary = summarise(results)
+    for result in summary['failed']:
+        print("FAILED "+result['path']+": "+result['error'], file=sys.stderr)
+    print(str(summary['files'])+" files, "+str(summary['frames'])+" frames, "+str(summary['recoloured'])+" recoloured ("+str(summary['skipped'])+" already up to date, "+str(summary['unchanged'])+" identical to input, "+str(len(summary['failed']))+" failed).")
+    if args.dedup:
+        print(dedup_line(summary))
+    if args.stats:
+        print(stage_table(results))
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
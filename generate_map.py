@@ -0,0 +1,118 @@
+import argparse
+import numpy as np
+from palette import PALETTE_PATH, RESERVED_INDICES, load_palette_lab, palette_distances
+from recolour import parse_indices, save_recolour_table
+
+# Builds recolour.txt mappings from color.pal instead of picking pairs by
+# hand. Every new colour is the nearest palette entry in CIELAB space, and the
+# reserved/colour-cycled entries are never mapped from or to.
+#   python generate_map.py --hue-range 90-160 --hue-shift -90 -o orange.txt
+#   python generate_map.py --pair 219:151 -o orange.txt
+#   python generate_map.py --ramp 215-219:147-151 --ramp 196-198:144-146 -o orange.txt
+
+MIN_CHROMA = 8  # greys and near-greys are left alone by hue based mappings
+HUE_TOLERANCE = 30  # degrees either side of a --pair source colour
+
+def usable_indices():
+    usable = np.ones(256, bool)
+    usable[RESERVED_INDICES] = False
+    return usable
+
+def lch(lab):
+    chroma = np.hypot(lab[:, 1], lab[:, 2])
+    hue = np.degrees(np.arctan2(lab[:, 2], lab[:, 1])) % 360
+    return lab[:, 0], chroma, hue
+
+def hue_distance(a, b):
+    d = np.abs(a - b) % 360
+    return np.minimum(d, 360 - d)
+
+def nearest(lab, colours, candidates):
+    # Index of the candidate palette entry closest to each Lab colour
+    candidates = np.flatnonzero(candidates)
+    d = ((colours[:, None, :] - lab[None, candidates, :]) ** 2).sum(axis=2)
+    return candidates[d.argmin(axis=1)]
+
+def coloured_sources(lab, hue_range=None):
+    # Usable, non-grey entries, optionally only those within a hue range
+    _, chroma, hue = lch(lab)
+    sources = usable_indices() & (chroma >= MIN_CHROMA)
+    if hue_range is not None:
+        lo, hi = hue_range
+        inside = (hue >= lo) & (hue <= hi) if lo <= hi else (hue >= lo) | (hue <= hi)
+        sources &= inside
+    return sources
+
+def hue_shift_table(lab, degrees, sources):
+    # Rotate the hue of every source colour, keeping lightness and chroma
+    table = np.arange(256, dtype=np.uint8)
+    idx = np.flatnonzero(sources)
+    light, chroma, hue = lch(lab[idx])
+    hue = np.radians(hue + degrees)
+    shifted = np.stack([light, chroma * np.cos(hue), chroma * np.sin(hue)], axis=1)
+    table[idx] = nearest(lab, shifted, usable_indices())
+    return table
+
+def pair_table(lab, src, dst, sources=None):
+    # Move src onto dst, and every colour of a similar hue by the same amount
+    if sources is None:
+        _, _, hue = lch(lab)
+        sources = coloured_sources(lab) & (hue_distance(hue, hue[src]) <= HUE_TOLERANCE)
+    sources = sources.copy()
+    sources[src] = True
+    table = np.arange(256, dtype=np.uint8)
+    idx = np.flatnonzero(sources)
+    table[idx] = nearest(lab, lab[idx] + (lab[dst] - lab[src]), usable_indices())
+    table[src] = dst
+    return table
+
+def ramp_table(distances, lab, src_ramp, dst_ramp, table=None):
+    # Map each colour of a source ramp onto the target ramp entry with the
+    # closest lightness, breaking ties by overall distance
+    table = np.arange(256, dtype=np.uint8) if table is None else table.copy()
+    src_ramp = np.asarray(src_ramp)
+    dst_ramp = np.asarray(dst_ramp)
+    cost = np.abs(lab[src_ramp, 0][:, None] - lab[dst_ramp, 0][None, :])
+    cost = cost + 0.01 * distances[np.ix_(src_ramp, dst_ramp)]
+    table[src_ramp] = dst_ramp[cost.argmin(axis=1)]
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a recolour mapping from the palette.")
+    parser.add_argument("-o", "--output", required=True, help="mapping file to write, in recolour.txt format")
+    parser.add_argument("--palette", default=PALETTE_PATH, help="palette file (default: %(default)s)")
+    parser.add_argument("--hue-shift", type=float, metavar="DEGREES", help="rotate the hue of the source colours")
+    parser.add_argument("--hue-range", metavar="LO-HI", help="only shift colours with a hue in this range (degrees, CIELAB)")
+    parser.add_argument("--pair", metavar="FROM:TO", help="move one colour onto another, and similar hues along with it")
+    parser.add_argument("--ramp", action="append", default=[], metavar="FROM:TO",
+                        help="map a ramp of indices onto another, eg 215-219:147-151 (repeatable)")
+    parser.add_argument("--sources", metavar="INDICES", help="palette indices to remap, eg 59-63,80-83,196-219")
+    args = parser.parse_args()
+
+    lab = load_palette_lab(args.palette)
+    usable = usable_indices()
+    sources = None
+    if args.sources:
+        sources = np.zeros(256, bool)
+        sources[parse_indices(args.sources)] = True
+        sources &= usable
+
+    table = np.arange(256, dtype=np.uint8)
+    if args.hue_shift is not None:
+        if sources is None:
+            hue_range = tuple(float(v) for v in args.hue_range.split("-")) if args.hue_range else None
+            sources = coloured_sources(lab, hue_range)
+        table = hue_shift_table(lab, args.hue_shift, sources)
+    elif args.pair:
+        src, dst = (int(v) for v in args.pair.split(":"))
+        for index in (src, dst):
+            if not 0 <= index < 256 or not usable[index]:
+                parser.error(f"--pair: {index} is a reserved or colour-cycled palette index (0, 229-255)")
+        table = pair_table(lab, src, dst, sources)
+    for ramp in args.ramp:
+        src_ramp, dst_ramp = (parse_indices(part) for part in ramp.split(":"))
+        table = ramp_table(palette_distances(args.palette), lab,
+                           [i for i in src_ramp if usable[i]], [i for i in dst_ramp if usable[i]], table)
+
+    save_recolour_table(table, args.output)
+    print("Wrote "+str(int((table != np.arange(256)).sum()))+" colour replacements to "+args.output)
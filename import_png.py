@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from frm import FRM_TYPES, frm_is_single_direction, frm_type_of, pack_frm
+from palette import PALETTE_PATH, load_palette, load_quantize_cube, palette_values, quantize
+
+# Turns edited images back into FRM/FR0-FR5 files:
+#   python import_png.py sheets/HMJMPSAA.FRM.png -o HMJMPSAA.FRM
+#   python import_png.py walk_*.png -o HMJMPSAB.FRM --directions 6 --fps 12
+# A PNG with a spritesheet.py JSON manifest next to it is cut back into the
+# frames, directions and shifts it was exported with. Otherwise every image
+# is one frame, in name order, split evenly over --directions directions.
+# Images saved with color.pal as their palette, like the sheets, keep their
+# palette indices exactly. Other images have their colours matched to
+# color.pal through a lookup cube (see palette.load_quantize_cube), and
+# transparent pixels become index 0; the reserved and colour-cycled palette
+# entries are never used for them.
+
+def load_indices(path, cube, palette=None):
+    # Palette indices of an image. One saved with the game palette attached,
+    # as spritesheet.py saves sheets, is read as it is, keeping indices that
+    # share a colour and the reserved ones; anything else goes through the
+    # cube. Pillow is only imported here so the batch tools can run without it.
+    from PIL import Image
+    values = palette_values(palette or load_palette())
+    with Image.open(path) as img:
+        if img.mode == "P":
+            used = img.getpalette()
+            if used and used == values[:len(used)]:
+                return np.asarray(img)
+        return quantize(np.asarray(img.convert("RGBA")), cube)
+
+def manifest_path_for(png_path):
+    return os.path.splitext(png_path)[0] + ".json"
+
+def frames_from_sheet(pixels, manifest):
+    # pack_frm directions (with shared rows passed as the same list) and
+    # shifts from a quantized sprite sheet
+    if manifest.get('scale', 1) != 1:
+        raise ValueError("sheet is a thumbnail, export it again without --thumbnail")
+    rows = {}
+    for f in manifest['frames']:
+        image = pixels[f['y']:f['y'] + f['height'], f['x']:f['x'] + f['width']]
+        rows.setdefault(f['block'], []).append((image, f['shift_x'], f['shift_y']))
+    directions = [rows[row] for row in manifest['directions']]
+    shifts = [tuple(xy) for xy in manifest.get('shifts', [(0, 0)] * 6)]
+    return directions, shifts
+
+def frames_from_images(images, direction_count):
+    if len(images) % direction_count:
+        raise ValueError(f"{len(images)} images don't split evenly into {direction_count} directions")
+    fpd = len(images) // direction_count
+    return [images[d * fpd:(d + 1) * fpd] for d in range(direction_count)]
+
+def import_sheet(png_path, out_path, cube, manifest=None, palette=None):
+    if manifest is None:
+        with open(manifest_path_for(png_path)) as f:
+            manifest = json.load(f)
+    directions, shifts = frames_from_sheet(load_indices(png_path, cube, palette), manifest)
+    if frm_is_single_direction(frm_type_of(out_path)):
+        directions = directions[:1]
+    write_frm(out_path, pack_frm(directions, manifest['fps'], manifest['action_frame'], shifts))
+    return sum(len(frames) for frames in {id(d): d for d in directions}.values())
+
+def import_images(png_paths, out_path, cube, direction_count=1, fps=10, action_frame=0, palette=None):
+    images = [load_indices(path, cube, palette) for path in png_paths]
+    directions = frames_from_images(images, direction_count)
+    write_frm(out_path, pack_frm(directions, fps, action_frame))
+    return len(images)
+
+def write_frm(out_path, data):
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, "wb") as f:
+        f.write(data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert PNG images or sprite sheets into an FRM/FR0-FR5 file.")
+    parser.add_argument("images", nargs="+", help="a sprite sheet with its JSON manifest, or one image per frame")
+    parser.add_argument("-o", "--output", required=True, help="FRM/FR0-FR5 file to write")
+    parser.add_argument("--directions", type=int, choices=(1, 6), default=None,
+                        help="directions the images are split into (default: 1 for FR0-FR5, 6 for FRM)")
+    parser.add_argument("--fps", type=int, default=10, help="frames per second (default: %(default)s)")
+    parser.add_argument("--action-frame", type=int, default=0, help="frame the action happens on")
+    parser.add_argument("--palette", default=PALETTE_PATH, help="palette file (default: %(default)s)")
+    args = parser.parse_args()
+
+    if frm_type_of(args.output) not in FRM_TYPES:
+        parser.error("the output must end in .FRM or .FR0-.FR5")
+    cube = load_quantize_cube(args.palette)
+    palette = load_palette(args.palette)
+    try:
+        if len(args.images) == 1 and os.path.exists(manifest_path_for(args.images[0])):
+            frames = import_sheet(args.images[0], args.output, cube, palette=palette)
+        else:
+            direction_count = args.directions or (1 if frm_is_single_direction(frm_type_of(args.output)) else 6)
+            frames = import_images(sorted(args.images), args.output, cube, direction_count,
+                                   args.fps, args.action_frame, palette)
+    except (OSError, ValueError, KeyError) as e:
+        print("FAILED: "+str(e), file=sys.stderr)
+        sys.exit(1)
+    print("Wrote "+str(frames)+" frames to "+args.output)
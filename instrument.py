@@ -0,0 +1,75 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+from contextlib import contextmanager
+
+# Timing and reporting for batch runs. Each result record carries a
+# 'timings' dict of seconds spent per stage:
+#   read      opening/reading the input file
+#   index     walking the frame headers
+#   cache     recolour cache lookups and restores
+#   histogram colour index lookups and new histograms
+#   recolour  the table lookups themselves
+#   write     saving the output
+# A stage shared by several variants of one file is only counted on the first.
+
+STAGES = ('read', 'index', 'cache', 'histogram', 'recolour', 'write')
+
+class StageTimer:
+    def __init__(self, timings=None):
+        self.timings = dict(timings or {})
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def take(self):
+        # The timings so far, starting afresh for the next result
+        timings, self.timings = self.timings, {}
+        return timings
+
+LOG_FIELDS = ('path', 'output', 'frames', 'recoloured', 'reused', 'bytes', 'changed', 'skipped', 'error', 'timings')
+
+def write_log(results, log_path):
+    # One JSON object per result, as a JSON-lines file; passes results through
+    with open(log_path, "w") as log:
+        for result in results:
+            log.write(json.dumps({key: result.get(key) for key in LOG_FIELDS}) + "\n")
+            yield result
+
+def stage_table(results, slowest=10):
+    # Plain-text table of time, data and frame rates per stage, followed by
+    # the slowest files
+    results = list(results)
+    total_bytes = sum(r['bytes'] for r in results)
+    total_frames = sum(r['recoloured'] for r in results)
+    lines = [f"{'stage':<10} {'seconds':>9} {'MB/s':>9} {'frames/s':>10}"]
+    for stage in STAGES:
+        seconds = sum(r.get('timings', {}).get(stage, 0.0) for r in results)
+        if not seconds:
+            continue
+        lines.append(f"{stage:<10} {seconds:>9.3f} {total_bytes / seconds / 1e6:>9.1f} {total_frames / seconds:>10.0f}")
+    ranked = sorted(results, key=lambda r: sum(r.get('timings', {}).values()), reverse=True)
+    if ranked:
+        lines.append("")
+        lines.append("slowest files:")
+        for r in ranked[:slowest]:
+            lines.append(f"  {sum(r.get('timings', {}).values()):8.3f}s  {r['path']}")
+    return "\n".join(lines)
+
+def profile_call(func, *args, sort='cumulative', limit=30, **kwargs):
+    # Run func under cProfile; returns its result and the formatted stats
+    profiler = cProfile.Profile()
+    value = profiler.runcall(func, *args, **kwargs)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return value, out.getvalue()
@@ -0,0 +1,117 @@
+import os
+import struct
+from functools import lru_cache
+import numpy as np
+from cache import hash_bytes
+
+PALETTE_PATH = 'color.pal'
+SCALE_FACTOR = 4  # will be adjusted dynamically per frame
+
+# Palette entries the game treats specially: 0 is transparent, 229-254 are
+# colour-cycled (slime, monitors, fire, shoreline, alarm) and 255 is unused.
+# Recolour mappings should neither use them as sources nor targets.
+RESERVED_INDICES = np.r_[0, 229:256]
+CUBE_BITS = 6  # color.pal channels are 6 bit, so a 64x64x64 cube loses nothing
+CUBE_DIR = '.palette_cache'  # quantize cubes, in the folder of the palette they were built from
+
+def load_palette(pal_path=PALETTE_PATH):
+    with open(pal_path, 'rb') as f:
+        data = f.read(768)
+    return [(r * 4, g * 4, b * 4) for r, g, b in struct.iter_unpack('BBB', data)]
+
+def palette_values(palette):
+    # The flat [r, g, b, r, g, b, ...] list Pillow uses for a palette
+    return [min(c, 255) for rgb in palette for c in rgb]
+
+def palette_image(pixels, width, height, palette):
+    # Palette ("P") mode image: the pixels are used as they are, with the
+    # palette attached, instead of being turned into RGB tuples one by one.
+    # Pillow is only imported here so batch tools can run without it.
+    from PIL import Image
+    img = Image.frombytes("P", (width, height), bytes(pixels))
+    img.putpalette(palette_values(palette))
+    return img
+
+def scale_image(pixels, width, height, palette, max_size=(300, 300)):
+    from PIL import Image
+    img = palette_image(pixels, width, height, palette)
+    scale_w = max_size[0] // width
+    scale_h = max_size[1] // height
+    scale = max(1, min(scale_w, scale_h, SCALE_FACTOR))
+    return img.resize((width * scale, height * scale), Image.NEAREST), scale
+
+def palette_lab(palette):
+    # CIELAB (D65) coordinates of each palette entry, as a (256, 3) array
+    rgb = np.minimum(np.asarray(palette, dtype=np.float64), 255) / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([[0.4124, 0.2126, 0.0193],
+                             [0.3576, 0.7152, 0.1192],
+                             [0.1805, 0.0722, 0.9505]])
+    xyz /= (0.95047, 1.0, 1.08883)
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+@lru_cache(maxsize=None)
+def load_palette_lab(pal_path=PALETTE_PATH):
+    lab = palette_lab(load_palette(pal_path))
+    lab.flags.writeable = False
+    return lab
+
+@lru_cache(maxsize=None)
+def palette_distances(pal_path=PALETTE_PATH):
+    # 256x256 perceptual (CIE76) distances between every pair of entries,
+    # computed once per palette file
+    lab = load_palette_lab(pal_path)
+    distances = np.sqrt(((lab[:, None, :] - lab[None, :, :]) ** 2).sum(axis=2))
+    distances.flags.writeable = False
+    return distances
+
+def build_quantize_cube(pal_path=PALETTE_PATH, bits=CUBE_BITS):
+    # Nearest usable palette entry (CIELAB distance) for every colour of a
+    # cube of 2**bits levels per channel, indexed by [r, g, b] >> (8 - bits)
+    levels = 1 << bits
+    step = 256 // levels
+    usable = np.ones(256, bool)
+    usable[RESERVED_INDICES] = False
+    candidates = np.flatnonzero(usable)
+    lab = load_palette_lab(pal_path)[candidates]
+    grid = np.arange(levels) * step
+    rgb = np.stack(np.meshgrid(grid, grid, grid, indexing='ij'), axis=-1).reshape(-1, 3)
+    cube = np.empty(len(rgb), np.uint8)
+    for start in range(0, len(rgb), 4096):
+        cells = palette_lab(rgb[start:start + 4096])
+        d = ((cells[:, None, :] - lab[None, :, :]) ** 2).sum(axis=2)
+        cube[start:start + 4096] = candidates[d.argmin(axis=1)]
+    return cube.reshape(levels, levels, levels)
+
+@lru_cache(maxsize=None)
+def load_quantize_cube(pal_path=PALETTE_PATH, bits=CUBE_BITS):
+    # build_quantize_cube, kept on disk in a folder next to the palette file
+    # (apart from the recolour cache, which may be cleared) and rebuilt only
+    # when the palette changes
+    with open(pal_path, 'rb') as f:
+        key = hash_bytes(f.read(768) + bytes([bits]))
+    cube_dir = os.path.join(os.path.dirname(os.path.abspath(pal_path)), CUBE_DIR)
+    cube_path = os.path.join(cube_dir, 'cube-' + key + '.npy')
+    try:
+        cube = np.load(cube_path)
+    except (OSError, ValueError):
+        cube = build_quantize_cube(pal_path, bits)
+        try:
+            os.makedirs(cube_dir, exist_ok=True)
+            np.save(cube_path, cube)
+        except OSError:
+            pass  # a read-only palette folder just means building it every run
+    cube.flags.writeable = False
+    return cube
+
+def quantize(rgba, cube, alpha_threshold=128):
+    # Palette indices of an (h, w, 3 or 4) RGB(A) array through the cube;
+    # pixels more transparent than alpha_threshold become index 0
+    shift = 9 - cube.shape[0].bit_length()
+    rgba = np.asarray(rgba, np.uint8)
+    rgb = rgba[..., :3] >> shift
+    pixels = cube[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
+    if rgba.shape[-1] == 4:
+        pixels = np.where(rgba[..., 3] < alpha_threshold, 0, pixels).astype(np.uint8)
+    return pixels
@@ -0,0 +1,113 @@
+import threading
+from queue import Queue, Empty
+from batch import collect_results, new_result, recolour_variants, write_output
+from dedup import FrameMemo
+from frm import FrmFile, frm_is_single_direction, frm_type_of
+from instrument import StageTimer
+
+# Threaded alternative to the process pool for slow or network drives, where
+# waiting on the disk costs more than recolouring. Reader threads load the
+# next files while this thread recolours the current one and writer threads
+# flush finished outputs. The queues between the stages are bounded, so a
+# fast stage waits for a slow one instead of piling files up in memory: at
+# most read_ahead inputs and write_behind files' outputs are held at once.
+
+READ_AHEAD = 8
+WRITE_BEHIND = 8
+IO_THREADS = 2
+
+_DONE = object()
+
+def read_frm(path, timer):
+    # Read the whole file up front: a memory map of a network share would
+    # only fetch the data once the recolour touches it
+    with timer.stage('read'):
+        with open(path, "rb") as f:
+            data = f.read()
+    with timer.stage('index'):
+        return FrmFile(data, frm_is_single_direction(frm_type_of(path)), path)
+
+def _reader(jobs, lock, read_q):
+    while True:
+        with lock:
+            job = next(jobs, None)
+        if job is None:
+            read_q.put(_DONE)
+            return
+        in_path, out_paths = job
+        timer = StageTimer()
+        try:
+            frm = read_frm(in_path, timer)
+        except Exception as e:
+            read_q.put((in_path, out_paths, None, timer.take(), e))
+        else:
+            read_q.put((in_path, out_paths, frm, timer.take(), None))
+
+def _writer(write_q, done_q, cache):
+    while True:
+        item = write_q.get()
+        if item is _DONE:
+            return
+        results, writes = item
+        for result, outdata in writes:
+            timer = StageTimer(result['timings'])
+            try:
+                with timer.stage('write'):
+                    write_output(result, outdata, cache)
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                result['cache'] = None
+                result['histograms'] = None
+            result['timings'] = timer.timings
+        done_q.put(results)
+
+def _recolour_stage(jobs, tables, cache, colour_index, readers, writers, read_ahead, write_behind, dedup):
+    # Yields each file's result list once all of its outputs are written
+    memo = FrameMemo() if dedup else None
+    read_q = Queue(read_ahead)
+    write_q = Queue(write_behind)
+    done_q = Queue()
+    job_iter = iter(jobs)
+    lock = threading.Lock()
+    read_threads = [threading.Thread(target=_reader, args=(job_iter, lock, read_q), daemon=True)
+                    for _ in range(readers)]
+    write_threads = [threading.Thread(target=_writer, args=(write_q, done_q, cache), daemon=True)
+                     for _ in range(writers)]
+    for t in read_threads + write_threads:
+        t.start()
+
+    finished = 0
+    while finished < readers:
+        item = read_q.get()
+        if item is _DONE:
+            finished += 1
+            continue
+        in_path, out_paths, frm, timings, error = item
+        writes = []
+        if error is None:
+            results = recolour_variants(in_path, list(zip(out_paths, tables)), cache, colour_index, frm,
+                                        lambda result, outdata, _: writes.append((result, outdata)), timings, memo)
+        else:
+            results = [new_result(in_path, out_path) for out_path in out_paths]
+            for result in results:
+                result['error'] = f"{type(error).__name__}: {error}"
+            results[0]['timings'] = timings
+        write_q.put((results, writes))  # blocks while the writers are behind
+        while True:
+            try:
+                yield done_q.get_nowait()
+            except Empty:
+                break
+
+    for _ in write_threads:
+        write_q.put(_DONE)
+    for t in write_threads:
+        t.join()
+    while not done_q.empty():
+        yield done_q.get()
+
+def pipelined_recolour(jobs, tables, cache=None, colour_index=None, readers=IO_THREADS, writers=IO_THREADS,
+                       read_ahead=READ_AHEAD, write_behind=WRITE_BEHIND, dedup=False):
+    # Same jobs, tables and results as batch.recolour_files_variants
+    return collect_results(_recolour_stage(jobs, tables, cache, colour_index, readers, writers,
+                                           read_ahead, write_behind, dedup), cache, colour_index)
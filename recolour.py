@@ -0,0 +1,65 @@
+import csv
+import numpy as np
+from frm import build_frm
+
+RECOLOUR_CSV_PATH = 'recolour.txt'
+
+# recolour.txt holds one "from,to" pair of palette indices (0-255) per line.
+# Rules are applied in file order, exactly like the old chain of
+# "[to if i==from else i for i in frameimage]" lines, so a later rule can
+# re-map the result of an earlier one.
+
+def compile_recolour_table(rules):
+    # Fold every rule into a single 256-entry lookup table: table[old] = new
+    table = np.arange(256, dtype=np.uint8)
+    for src, dst in rules:
+        table[table == src] = dst
+    return table
+
+def load_recolour_table(csv_path=RECOLOUR_CSV_PATH):
+    # A file with rules limited to part of the frames (see regions.py) loads
+    # as a RegionRules, which can be used everywhere a table can
+    from regions import load_region_rules
+    rules = load_region_rules(csv_path)
+    if rules.is_global():
+        return rules.table
+    return rules
+
+def save_recolour_table(table, csv_path):
+    # Write a table back out as recolour.txt pairs, leaving out unmapped colours
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for src in range(256):
+            if table[src] != src:
+                writer.writerow((src, int(table[src])))
+
+def parse_range(text):
+    # "59-63" -> [59, 60, 61, 62, 63], "219" -> [219]
+    if "-" in text:
+        lo, hi = (int(v) for v in text.split("-"))
+        return list(range(lo, hi + 1))
+    return [int(text)]
+
+def parse_indices(text):
+    return [i for part in text.split(",") for i in parse_range(part)]
+
+def recolour_pixels(pixels, table):
+    # One vectorized pass over a frame (or a whole buffer) of palette indices
+    return np.take(table, np.asarray(pixels, dtype=np.uint8))
+
+def recolour_frm(frm, table, frames=None, memo=None):
+    # Recolour the given frame numbers (default: every frame) of an FrmFile,
+    # returning the whole new file. With a dedup.FrameMemo, frames already
+    # recoloured earlier in the run are reused instead.
+    if not isinstance(table, np.ndarray):
+        return table.recolour_frm(frm, frames, memo)
+    if frames is None:
+        frames = range(len(frm))
+    out = build_frm(frm)
+    for i in frames:
+        pixels = frm.frame(i)
+        if memo is None:
+            out[frm.frame_slice(i)] = recolour_pixels(pixels, table)
+        else:
+            out[frm.frame_slice(i)] = memo.recolour(pixels, table, lambda: recolour_pixels(pixels, table))
+    return out
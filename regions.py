@@ -0,0 +1,195 @@
+import csv
+import os
+import struct
+import numpy as np
+from frm import build_frm, frm_is_single_direction, frm_type_of
+from recolour import compile_recolour_table, parse_indices
+
+# Recolour rules limited to part of each frame, for recolours like "armour
+# only, not skin" that a palette-wide mapping can't do. A rules file is
+# recolour.txt with optional extra columns after "from,to":
+#   219,151,rect=10:0:40:25      only inside a rectangle (x0:y0:x1:y1, inclusive)
+#   219,151,mask=armour          only where the mask named "armour" is set
+#   219,151,fill=22:30           only in the area of mapped colours joined to pixel x:y
+#   219,151,frames=0-5           only in these frame numbers
+#   219,151,direction=2,3        only in these directions (0-5; FR0-FR5 files are their own)
+# Several columns on one line must all hold. Lines without any are applied
+# everywhere, as in recolour.txt, and rules still apply in file order.
+#
+# Masks live next to the rules file, "orange.txt" -> "orange.masks.npz", one
+# boolean array per frame under "name/frame" or per direction under
+# "name/d<direction>". A mask is only used on frames of the same size; the
+# Recolour GUI paints and saves them.
+
+REGION_KEYS = ('rect', 'mask', 'fill', 'frames', 'direction')
+
+def masks_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".masks.npz"
+
+def load_masks(masks_path):
+    if not os.path.exists(masks_path):
+        return {}
+    with np.load(masks_path) as npz:
+        return {key: npz[key].astype(bool) for key in npz.files}
+
+def save_masks(masks, masks_path):
+    np.savez_compressed(masks_path, **masks)
+
+def parse_where(columns, where_from):
+    # ("rect=0:0:9:9", "direction=2") -> (("direction", "2"), ("rect", "0:0:9:9"))
+    where = {}
+    for column in columns:
+        key, _, value = column.strip().partition("=")
+        if key not in REGION_KEYS or not value:
+            raise ValueError(f"{where_from}: unknown rule column '{column}'")
+        where[key] = value.strip()
+    return tuple(sorted(where.items()))
+
+def load_region_rules(csv_path, masks_path=None, require_masks=True):
+    # Raises ValueError for a mask= rule naming a mask the masks file doesn't
+    # have, which would otherwise silently change nothing; require_masks=False
+    # allows that while the masks are still to be painted
+    rules = []
+    with open(csv_path, newline='') as f:
+        for line, row in enumerate(csv.reader(f), 1):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            rules.append((int(row[0]), int(row[1]), parse_where(row[2:], f"{csv_path} line {line}")))
+    masks = {}
+    names = {dict(where)['mask'] for _, _, where in rules if 'mask' in dict(where)}
+    if names:
+        masks_path = masks_path or masks_path_for(csv_path)
+        masks = load_masks(masks_path)
+        missing = names - {key.rpartition("/")[0] for key in masks}
+        if missing and require_masks:
+            raise ValueError(f"{csv_path}: no mask named {', '.join(sorted(missing))} in {masks_path}")
+    return RegionRules(rules, masks)
+
+def frame_directions(header, frm_type):
+    # The directions (0-5) each frame of a file is shown in; frames of an FRM
+    # direction block shared by several directions belong to all of them
+    fpd = struct.unpack_from(">H", header, 8)[0]
+    if frm_is_single_direction(frm_type):
+        return [(int(frm_type[-1]),)] * fpd
+    offsets = struct.unpack_from(">6I", header, 34)
+    blocks = sorted(set(offsets))
+    return [tuple(d for d, o in enumerate(offsets) if o == block) for block in blocks for _ in range(fpd)]
+
+def flood_fill(allowed, x, y):
+    # The 4-connected part of allowed containing pixel x, y, grown a step at a
+    # time with whole-array shifts
+    region = np.zeros_like(allowed)
+    if not (0 <= y < allowed.shape[0] and 0 <= x < allowed.shape[1]) or not allowed[y, x]:
+        return region
+    region[y, x] = True
+    while True:
+        grown = region.copy()
+        grown[1:] |= region[:-1]
+        grown[:-1] |= region[1:]
+        grown[:, 1:] |= region[:, :-1]
+        grown[:, :-1] |= region[:, 1:]
+        grown &= allowed
+        if np.array_equal(grown, region):
+            return region
+        region = grown
+
+class RegionRules:
+    # Consecutive rules with the same columns are folded into one lookup
+    # table, like compile_recolour_table does for a whole recolour.txt, and
+    # each table is applied to its region of a frame in a single pass.
+
+    def __init__(self, rules, masks=None):
+        self.rules = rules
+        self.masks = masks or {}
+        self.groups = []
+        for src, dst, where in rules:
+            if not self.groups or self.groups[-1][0] != where:
+                self.groups.append((where, []))
+            self.groups[-1][1].append((src, dst))
+        self.groups = [(dict(where), compile_recolour_table(pairs)) for where, pairs in self.groups]
+        self.table = compile_recolour_table([(src, dst) for src, dst, _ in rules])
+
+    def is_global(self):
+        return all(not where for where, _ in self.groups)
+
+    def mapped_colours(self):
+        # Every palette index some rule may change; a frame without any of
+        # them is left as it is
+        changed = np.zeros(256, bool)
+        for _, table in self.groups:
+            changed |= table != np.arange(256)
+        return np.flatnonzero(changed)
+
+    def key_bytes(self, frm, colours):
+        # What recolouring a file using these colours depends on, for the
+        # cache: identical data recolours differently as an FRM and an FR0.
+        # A later group also sees the colours earlier ones turned pixels into.
+        parts = [repr(self.frame_directions(frm)).encode(), repr(sorted(self.masks)).encode()]
+        colours = np.asarray(colours, np.uint8)
+        for where, table in self.groups:
+            parts += [repr(sorted(where.items())).encode(), colours.tobytes(), table[colours].tobytes()]
+            colours = np.union1d(colours, table[colours])
+        for key in sorted(self.masks):
+            parts.append(np.packbits(self.masks[key]).tobytes())
+        return b"".join(parts)
+
+    def region(self, where, pixels, table, index, directions):
+        # Where in a frame a group of rules applies: a boolean mask, a pair of
+        # slices, or None when it doesn't apply to this frame at all
+        if 'frames' in where and index not in parse_indices(where['frames']):
+            return None
+        if 'direction' in where and not set(directions) & set(parse_indices(where['direction'])):
+            return None
+        rect = (slice(None), slice(None))
+        if 'rect' in where:
+            x0, y0, x1, y1 = (int(v) for v in where['rect'].split(":"))
+            rect = (slice(max(y0, 0), y1 + 1), slice(max(x0, 0), x1 + 1))
+        if 'mask' not in where and 'fill' not in where:
+            return rect
+        selected = np.zeros(pixels.shape, bool)
+        selected[rect] = True
+        if 'mask' in where:
+            keys = [where['mask'] + "/" + str(index)] + [where['mask'] + "/d" + str(d) for d in directions]
+            masks = [self.masks[k] for k in keys if k in self.masks and self.masks[k].shape == pixels.shape]
+            if not masks:
+                return None
+            selected &= masks[0]
+        if 'fill' in where:
+            x, y = (int(v) for v in where['fill'].split(":"))
+            selected &= flood_fill(table[pixels] != pixels, x, y)
+        return selected
+
+    def recolour_image(self, pixels, index=0, directions=(0,)):
+        # A recoloured copy of one 2-D frame
+        out = np.array(pixels, dtype=np.uint8)
+        for where, table in self.groups:
+            if not where:
+                out = table[out]
+                continue
+            region = self.region(where, out, table, index, directions)
+            if region is not None:
+                out[region] = table[out[region]]
+        return out
+
+    def frame_directions(self, frm):
+        frm_type = frm_type_of(frm.path) if frm.path else "FR0" if frm.single_direction else "FRM"
+        return frame_directions(frm.header, frm_type)
+
+    def recolour_frm(self, frm, frames=None, memo=None):
+        # Same as recolour.recolour_frm with a plain table
+        if frames is None:
+            frames = range(len(frm))
+        directions = self.frame_directions(frm)
+        # Rules tied to frame numbers, directions or masks can recolour the
+        # same pixels differently depending on where the frame is
+        placed = any(key in where for where, _ in self.groups for key in ('frames', 'direction', 'mask'))
+        out = build_frm(frm)
+        for i in frames:
+            image = frm.frame_image(i)
+            recolour = lambda: self.recolour_image(image, int(i), directions[i]).ravel()
+            if memo is None:
+                out[frm.frame_slice(i)] = recolour()
+            else:
+                context = (int(i), directions[i]) if placed else ()
+                out[frm.frame_slice(i)] = memo.recolour(image, self, recolour, context)
+        return out
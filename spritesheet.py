@@ -0,0 +1,138 @@
+import argparse
+import html
+import json
+import os
+import struct
+import numpy as np
+from batch import find_frm_files, pool_map
+from frm import FrmFile
+from palette import PALETTE_PATH, load_palette, palette_image
+from recolour import recolour_frm
+
+# Exports every frame of an FRM/FR0-FR5 file as one sprite sheet PNG, with a
+# JSON manifest of where each frame is, for reviewing batch results in a
+# browser instead of stepping through them in the Recolour GUI:
+#   python spritesheet.py "My Output Folder" -o sheets
+#   python spritesheet.py "My Input Folder" -o preview -m blue.txt --thumbnail 256
+# With -m the files are recoloured in memory first, so a mapping can be
+# previewed without saving any FRMs. A folder also gets an index.html showing
+# every sheet.
+#
+# Each row of a sheet is one direction block and each column one frame of it.
+# Cells are the size of the largest frame, with frames aligned on the middle
+# of their bottom edge (where the game anchors them) so an animation lines up
+# across a row. Index 0 is saved as transparent. import_png.py turns an
+# edited sheet and its manifest back into an FRM.
+
+def sheet_layout(frm):
+    # (cell width, cell height, rows, columns) of the sheet for an FrmFile
+    fpd = frm.frames_per_direction
+    cell_w = int(frm.widths.max(initial=0))
+    cell_h = int(frm.heights.max(initial=0))
+    return cell_w, cell_h, len(frm.blocks), fpd
+
+def pack_sheet(frm):
+    # The sheet as a 2-D array of palette indices, and its manifest
+    cell_w, cell_h, rows, cols = sheet_layout(frm)
+    sheet = np.zeros((max(rows * cell_h, 1), max(cols * cell_w, 1)), np.uint8)
+    frames = []
+    for i in range(len(frm)):
+        row, col = divmod(i, cols)
+        w, h = int(frm.widths[i]), int(frm.heights[i])
+        x = col * cell_w + (cell_w - w) // 2
+        y = row * cell_h + cell_h - h
+        sheet[y:y + h, x:x + w] = frm.frame_image(i)
+        shift_x, shift_y = struct.unpack_from(">hh", frm.frame_header(i), 8)
+        frames.append({'frame': i, 'block': row, 'index': col, 'x': x, 'y': y, 'width': w, 'height': h,
+                       'shift_x': shift_x, 'shift_y': shift_y})
+    fps, action_frame = struct.unpack_from(">HH", frm.header, 4)
+    shifts = struct.unpack_from(">6h6h", frm.header, 10)
+    manifest = {
+        'fps': fps,
+        'action_frame': action_frame,
+        'frames_per_direction': cols,
+        'cell_width': cell_w,
+        'cell_height': cell_h,
+        'directions': frm.directions,  # sheet row of each direction
+        'shifts': [list(xy) for xy in zip(shifts[:6], shifts[6:])],  # x, y of each direction
+        'frames': frames,
+    }
+    return sheet, manifest
+
+def save_sheet(sheet, manifest, png_path, palette, max_size=None):
+    img = palette_image(sheet, sheet.shape[1], sheet.shape[0], palette)
+    if max_size:
+        img.thumbnail((max_size, max_size))
+        scale = img.width / sheet.shape[1]
+        manifest = dict(manifest, scale=scale)
+    os.makedirs(os.path.dirname(png_path) or '.', exist_ok=True)
+    img.save(png_path, transparency=0)
+    with open(os.path.splitext(png_path)[0] + ".json", "w") as f:
+        json.dump(manifest, f, indent=1)
+
+def export_sheet(in_path, png_path, palette, table=None, max_size=None):
+    # Returns a result record, like batch.recolour_file; never raises
+    result = {'path': in_path, 'output': png_path, 'frames': 0, 'error': None}
+    try:
+        with FrmFile.open(in_path) as frm:
+            if table is not None:
+                frm = FrmFile(recolour_frm(frm, table), frm.single_direction, in_path)
+            sheet, manifest = pack_sheet(frm)
+        result['frames'] = len(manifest['frames'])
+        manifest['source'] = in_path
+        save_sheet(sheet, manifest, png_path, palette, max_size)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+def _export_job(job, palette, table, max_size):
+    return export_sheet(job[0], job[1], palette, table, max_size)
+
+def export_sheets(jobs, palette, table=None, max_size=None, workers=None, chunksize=4):
+    # Each job is (FRM path, PNG path). Yields a result per file as it
+    # finishes (see batch.pool_map).
+    return pool_map(_export_job, jobs, (palette, table, max_size), workers, chunksize)
+
+def write_index(results, outdir):
+    # A page showing every sheet, for looking through them in a browser
+    rows = []
+    for result in sorted(results, key=lambda r: r['path']):
+        if result['error']:
+            continue
+        src = html.escape(os.path.relpath(result['output'], outdir).replace(os.sep, "/"))
+        rows.append(f'<figure><img src="{src}" loading="lazy"><figcaption>{html.escape(result["path"])}'
+                    f'</figcaption></figure>')
+    with open(os.path.join(outdir, "index.html"), "w") as f:
+        f.write("<!DOCTYPE html>\n<meta charset=\"utf-8\">\n<title>Sprite sheets</title>\n"
+                "<style>body{background:#444;color:#eee;font:12px sans-serif}"
+                "img{image-rendering:pixelated;background:#888}</style>\n" + "\n".join(rows) + "\n")
+
+if __name__ == "__main__":
+    import sys
+    from recolour import load_recolour_table
+    parser = argparse.ArgumentParser(description="Export FRM/FR0-FR5 files as sprite sheet PNGs with JSON manifests.")
+    parser.add_argument("inputs", nargs="+", help="FRM files or folders")
+    parser.add_argument("-o", "--output", required=True, help="folder to save the sheets in")
+    parser.add_argument("-m", "--map", help="recolour with this mapping first (nothing is written but the sheets)")
+    parser.add_argument("--palette", default=PALETTE_PATH, help="palette file (default: %(default)s)")
+    parser.add_argument("--thumbnail", type=int, metavar="PX", help="shrink sheets to fit in PX by PX")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="files exported at once (default: one per core)")
+    args = parser.parse_args()
+
+    jobs = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            jobs += [(os.path.join(item, rel), os.path.join(args.output, rel + ".png")) for rel in find_frm_files(item)]
+        else:
+            jobs.append((item, os.path.join(args.output, os.path.basename(item) + ".png")))
+    table = load_recolour_table(args.map) if args.map else None
+    results = []
+    for result in export_sheets(jobs, load_palette(args.palette), table, args.thumbnail, args.workers):
+        if result['error']:
+            print("FAILED "+result['path']+": "+result['error'], file=sys.stderr)
+        results.append(result)
+    os.makedirs(args.output, exist_ok=True)
+    write_index(results, args.output)
+    failed = sum(1 for r in results if r['error'])
+    print("Exported "+str(len(results) - failed)+" sheets to "+args.output+" ("+str(failed)+" failed).")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,136 @@
+import argparse
+import os
+import struct
+import sys
+import numpy as np
+from batch import pool_map
+from frm import FRAME_HEADER_SIZE, FRM_HEADER_SIZE, FrmFile
+
+# Read-only integrity checks for FRM/FR0-FR5 files, for finding broken files
+# in a mod tree before starting a long recolour job:
+#   python validate.py "My Input Folder" -j 8
+# Only the file header and frame headers are read (the same index pass the
+# recolour does); pixel data is never copied. Every problem is reported as
+#   {'severity': 'error' or 'warning', 'check': ..., 'frame': ..., 'message': ...}
+# Errors are files the recolour would fail on or write out wrongly; warnings
+# are unusual values the game may still accept.
+
+FRM_VERSION = 4
+
+def problem(severity, check, message, frame=None):
+    return {'severity': severity, 'check': check, 'frame': frame, 'message': message}
+
+def check_header(frm):
+    version, fps, action_frame, fpd = struct.unpack_from(">IHHH", frm.header)
+    problems = []
+    if version != FRM_VERSION:
+        problems.append(problem('warning', 'version', f"version is {version}, not {FRM_VERSION}"))
+    if fps == 0:
+        problems.append(problem('warning', 'fps', "frames per second is 0"))
+    if fpd == 0:
+        problems.append(problem('error', 'frames', "no frames per direction"))
+    elif action_frame >= fpd:
+        problems.append(problem('warning', 'action_frame',
+                                f"action frame {action_frame} is past the last frame {fpd - 1}"))
+    return problems
+
+def check_directions(frm):
+    # Each distinct direction block has to start where the one before it
+    # ends: a gap or overlap means the offset table or a frame size is wrong
+    problems = []
+    if frm.blocks[0] != 0:
+        problems.append(problem('error', 'direction_offsets',
+                                f"first direction starts at {frm.blocks[0]}, not 0"))
+    fpd = frm.frames_per_direction
+    if fpd == 0:
+        return problems
+    last = np.arange(1, len(frm.blocks)) * fpd - 1
+    ends = frm.offsets[last] + FRAME_HEADER_SIZE + frm.sizes[last] - FRM_HEADER_SIZE
+    for start, end in zip(frm.blocks[1:], ends):
+        if start != end:
+            kind = "a gap" if start > end else "an overlap"
+            problems.append(problem('error', 'direction_offsets',
+                                    f"direction data at {start} leaves {kind} after the one ending at {end}"))
+    return problems
+
+def check_frames(frm):
+    problems = []
+    for i in np.flatnonzero(frm.sizes != frm.widths * frm.heights):
+        problems.append(problem('error', 'frame_size',
+                                f"size {frm.sizes[i]} is not width*height {frm.widths[i]}x{frm.heights[i]}", int(i)))
+    for i in np.flatnonzero((frm.widths == 0) | (frm.heights == 0)):
+        problems.append(problem('warning', 'frame_empty', f"frame is {frm.widths[i]}x{frm.heights[i]}", int(i)))
+    return problems
+
+def check_length(frm):
+    problems = []
+    data_size = struct.unpack_from(">I", frm.header, 58)[0]
+    if data_size != frm.end - FRM_HEADER_SIZE:
+        problems.append(problem('error', 'data_size',
+                                f"header data size is {data_size}, the frames take {frm.end - FRM_HEADER_SIZE}"))
+    if frm.end < len(frm.data):
+        problems.append(problem('warning', 'trailing_data', f"{len(frm.data) - frm.end} bytes after the last frame"))
+    return problems
+
+def check_frm(frm):
+    # Every problem found in an indexed FrmFile
+    return check_header(frm) + check_directions(frm) + check_frames(frm) + check_length(frm)
+
+def validate_file(path):
+    report = {'path': path, 'frames': 0, 'bytes': 0, 'problems': []}
+    try:
+        report['bytes'] = os.path.getsize(path)
+        if report['bytes'] == 0:
+            raise ValueError("file is empty")
+        with FrmFile.open(path) as frm:
+            report['frames'] = len(frm)
+            report['problems'] = check_frm(frm)
+    except (OSError, ValueError, struct.error) as e:
+        report['problems'].append(problem('error', 'unreadable', str(e)))
+    return report
+
+def validate_files(paths, workers=None, chunksize=32):
+    # Yields a report per file as each one finishes (see batch.pool_map)
+    return pool_map(validate_file, paths, (), workers, chunksize)
+
+def has_errors(report):
+    return any(p['severity'] == 'error' for p in report['problems'])
+
+def print_reports(reports, warnings=True, out=sys.stdout):
+    # Prints each file's problems; returns the files checked and those with errors
+    files = failed = 0
+    for report in reports:
+        files += 1
+        failed += has_errors(report)
+        for p in report['problems']:
+            if p['severity'] == 'warning' and not warnings:
+                continue
+            where = report['path'] if p['frame'] is None else report['path']+" frame "+str(p['frame'])
+            print(p['severity'].upper()+" "+where+": "+p['message'], file=out)
+    return files, failed
+
+if __name__ == "__main__":
+    import json
+    from batch import find_frm_files
+    parser = argparse.ArgumentParser(description="Check FRM/FR0-FR5 files for broken headers and frame sizes.")
+    parser.add_argument("inputs", nargs="+", help="FRM files or folders to check")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="files checked at once (default: one per core)")
+    parser.add_argument("--no-warnings", dest="warnings", action="store_false", help="only print errors")
+    parser.add_argument("--json", metavar="FILE", help="also save every file's report as JSON lines")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            paths += [os.path.join(item, rel) for rel in find_frm_files(item)]
+        else:
+            paths.append(item)
+    reports = validate_files(paths, args.workers)
+    if args.json:
+        reports = list(reports)
+        with open(args.json, "w") as f:
+            for report in reports:
+                f.write(json.dumps(report) + "\n")
+    files, failed = print_reports(reports, args.warnings)
+    print("Checked "+str(files)+" files, "+str(failed)+" with errors.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,191 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from batch import recolour_files, summarise
+from cache import RecolourCache
+from colour_index import ColourIndex, mapped_colours
+from frm import is_frm_file
+from recolour import RECOLOUR_CSV_PATH, load_recolour_table
+
+# Keeps an output folder up to date with an input folder that artists keep
+# adding to, instead of re-running the folder script by hand:
+#   python watch.py "My Input Folder" -o "My Output Folder" -m recolour.txt
+# The input folder and the mapping file are polled (a stat of every file,
+# no reading) every --interval seconds. Changes are collected until nothing
+# has changed for --settle seconds, so a file still being saved, or a whole
+# folder being copied in, is picked up once when it is done. Then only the
+# files that were added or modified are recoloured, and outputs of deleted
+# files are removed. When the mapping file changes, only files using a colour
+# whose mapping changed are redone; the colour index (see colour_index.py)
+# knows which those are. Stop with Ctrl+C.
+
+POLL_INTERVAL = 1.0
+SETTLE_TIME = 2.0
+
+def snapshot(indir, recursive=True):
+    # {path relative to indir: (size, mtime_ns)} of every FRM under indir
+    found = {}
+    pending = [indir]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    pending.append(entry.path)
+            elif is_frm_file(entry.name):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found[os.path.relpath(entry.path, indir)] = (st.st_size, st.st_mtime_ns)
+    return found
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def changed_colours(old, new):
+    # Palette indices that recolour differently with table new than with old
+    if isinstance(old, np.ndarray) and isinstance(new, np.ndarray):
+        return np.flatnonzero(old != new)
+    # Region rules can move a colour in one place and not another, so every
+    # colour either one maps counts
+    return np.union1d(mapped_colours(old), mapped_colours(new))
+
+class Watcher:
+    def __init__(self, indir, outdir, map_path=RECOLOUR_CSV_PATH, recursive=True, workers=None, chunksize=8,
+                 cache=None, colour_index=None, dedup=False):
+        self.indir = indir
+        self.outdir = outdir
+        self.map_path = map_path
+        self.recursive = recursive
+        self.workers = workers
+        self.chunksize = chunksize
+        self.cache = cache
+        self.colour_index = colour_index
+        self.dedup = dedup
+        self.table = load_recolour_table(map_path)
+        self.files = {}
+        self.map_stamp = file_stamp(map_path)
+        # Changes seen but not acted on yet, waiting for things to settle
+        self.modified = set()
+        self.removed = set()
+        self.map_changed = False
+        self.last_change = None
+
+    def poll(self):
+        # Note what changed since the last poll; True if anything did
+        files = snapshot(self.indir, self.recursive)
+        map_stamp = file_stamp(self.map_path)
+        modified = {rel for rel, st in files.items() if self.files.get(rel) != st}
+        removed = self.files.keys() - files.keys()
+        if not modified and not removed and map_stamp == self.map_stamp:
+            return False
+        self.modified = (self.modified | modified) - removed
+        self.removed = (self.removed | removed) - files.keys()
+        self.map_changed |= map_stamp != self.map_stamp
+        self.files, self.map_stamp = files, map_stamp
+        self.last_change = time.monotonic()
+        return True
+
+    def settled(self, settle=SETTLE_TIME):
+        pending = self.modified or self.removed or self.map_changed
+        return bool(pending) and time.monotonic() - self.last_change >= settle
+
+    def affected_by_map(self):
+        # Files to redo after the mapping file changed. Keeps the old table,
+        # and returns nothing, if the new file can't be loaded (eg it is
+        # still being saved); it is tried again on its next change.
+        try:
+            table = load_recolour_table(self.map_path)
+        except (OSError, ValueError, IndexError) as e:
+            print("FAILED "+self.map_path+": "+f"{type(e).__name__}: {e}", file=sys.stderr)
+            return set()
+        colours = changed_colours(self.table, table)
+        self.table = table
+        if self.colour_index is None:
+            # The cache, if any, still skips the files the change misses
+            return set(self.files) if len(colours) else set()
+        paths = [os.path.join(self.indir, rel) for rel in self.files]
+        self.colour_index.scan(paths)
+        using = {path for c in colours for path, _ in self.colour_index.files_using(c)}
+        return {rel for rel, path in zip(self.files, paths) if os.path.abspath(path) in using}
+
+    def update(self):
+        # Act on the settled changes: returns the result records of the files
+        # recoloured and the relative paths of the outputs removed
+        redo = self.modified
+        if self.map_changed:
+            redo = redo | self.affected_by_map()
+        removed = sorted(self.removed)
+        self.modified, self.removed, self.map_changed = set(), set(), False
+        for rel in removed:
+            try:
+                os.remove(os.path.join(self.outdir, rel))
+            except FileNotFoundError:
+                pass
+        return self.recolour(sorted(redo)), removed
+
+    def recolour(self, rels):
+        jobs = [(os.path.join(self.indir, rel), os.path.join(self.outdir, rel)) for rel in rels]
+        return list(recolour_files(jobs, self.table, self.workers, self.chunksize, self.cache,
+                                   self.colour_index, self.dedup))
+
+    def start(self):
+        # Bring the whole output folder up to date once, before watching
+        self.poll()
+        self.modified = set()
+        self.last_change = None
+        return self.recolour(sorted(self.files))
+
+    def run(self, interval=POLL_INTERVAL, settle=SETTLE_TIME, report=None):
+        # Poll until interrupted, passing what each update did to report
+        report = report or print_update
+        report(self.start(), [])
+        while True:
+            time.sleep(interval)
+            if not self.poll() and self.settled(settle):
+                report(*self.update())
+
+def print_update(results, removed):
+    summary = summarise(results)
+    for result in summary['failed']:
+        print("FAILED "+result['path']+": "+result['error'], file=sys.stderr)
+    line = time.strftime("%H:%M:%S")+" "+str(summary['files'])+" files, "+str(summary['recoloured'])+" frames recoloured ("+str(summary['skipped'])+" already up to date, "+str(len(summary['failed']))+" failed)"
+    if removed:
+        line += ", "+str(len(removed))+" removed"
+    print(line+".", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep a folder of recoloured FRM files up to date as the inputs and mapping change.")
+    parser.add_argument("input", help="folder of FRM/FR0-FR5 files to watch")
+    parser.add_argument("-o", "--output", required=True, help="folder to keep the recoloured files in")
+    parser.add_argument("-m", "--map", default=RECOLOUR_CSV_PATH, help="recolour mapping file, also watched (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="files recoloured at once (default: one per core)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between looks at the folder (default: %(default)s)")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME,
+                        help="seconds without changes before recolouring what changed (default: %(default)s)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", help="don't watch subfolders")
+    parser.add_argument("--cache", metavar="DIR", help="skip files whose output is already up to date, remembered in DIR")
+    parser.add_argument("--colour-index", metavar="FILE", default="colour_index.sqlite",
+                        help="where the colours each file uses are kept, to find the files a mapping change affects (default: %(default)s)")
+    parser.add_argument("--dedup", action="store_true", help="recolour frames that are exact copies of another only once")
+    args = parser.parse_args()
+
+    cache = RecolourCache(args.cache) if args.cache else None
+    watcher = Watcher(args.input, args.output, args.map, args.recursive, args.workers, 8, cache,
+                      ColourIndex(args.colour_index), args.dedup)
+    print("Watching "+args.input+" and "+args.map+", press Ctrl+C to stop.", flush=True)
+    try:
+        watcher.run(args.interval, args.settle)
+    except KeyboardInterrupt:
+        pass